@@ -0,0 +1,70 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+class PacketStore:
+    """
+    Packets waiting to be delivered to each player, kept in an SQLite file.
+    Queuing a packet is a single insert, and a packet is only deleted once
+    the player has acknowledged it (see `ack`), so a dropped connection or a
+    crash just means it gets sent again next time.
+
+    Every packet is given an increasing "id", which is what acks refer to.
+    Ids only mean anything within one store (a new file starts again from 1),
+    so each store also has a random `uid`, made when the file is.
+    """
+    def __init__(self, fname="queued_packets.db"):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(fname, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL") # don't lose anything that's been queued
+        self.db.execute("""CREATE TABLE IF NOT EXISTS packets (
+                               id INTEGER PRIMARY KEY AUTOINCREMENT,
+                               player TEXT NOT NULL,
+                               packet TEXT NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS packets_player ON packets (player, id)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('uid', ?)", (uuid.uuid4().hex,))
+        self.uid = self.db.execute("SELECT value FROM meta WHERE key = 'uid'").fetchone()[0]
+
+    def enqueue(self, packet):
+        """Queue `packet` for `packet["player"]`, returning its id"""
+        with self.lock:
+            return self.db.execute("INSERT INTO packets (player, packet) VALUES (?, ?)",
+                                   (packet["player"], json.dumps(packet))).lastrowid
+
+    def pending(self, player):
+        """Everything not yet acknowledged by `player`, oldest first, each with its "id" set"""
+        with self.lock:
+            rows = self.db.execute("SELECT id, packet FROM packets WHERE player = ? ORDER BY id", (player,)).fetchall()
+        packets = []
+        for id, packet in rows:
+            packet = json.loads(packet)
+            packet["id"] = id
+            packets.append(packet)
+        return packets
+
+    def ack(self, player, id):
+        """`player` has got every packet up to and including `id`, so forget about them"""
+        with self.lock:
+            self.db.execute("DELETE FROM packets WHERE player = ? AND id <= ?", (player, id))
+
+    def migrate(self, fname):
+        """Move the packets from an old style queued_packets.json ({player: [packet]}) into the store"""
+        if not os.path.isfile(fname):
+            return
+        with open(fname, "r") as f:
+            player_queues = json.loads(f.read())
+        with self.lock:
+            with self.db: # one transaction, so it's all or nothing
+                self.db.execute("BEGIN")
+                for player, queue in player_queues.items():
+                    for packet in queue:
+                        self.db.execute("INSERT INTO packets (player, packet) VALUES (?, ?)", (player, json.dumps(packet)))
+        os.replace(fname, fname + ".migrated")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -1,62 +1,299 @@
 import socket
 import json
 import os
+import queue
+import sys
 import threading
-if os.path.isfile("queued_packets.json"):
-    with open("queued_packets.json", "r") as f:
-        player_queues = json.loads(f.read())
-else:
-    player_queues = {}
-
-def recv_data(s):
-    data = b""
-    while not b"\n" in data:
-        d = s.recv(1024)
-        if not d:
-            break
-        data += d
+import asyncio
+from packet_store import PacketStore
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from wire import FRAMING, MAX_FRAME, HEADER, encode_frames, decode_frame, encode_line
+
+# biggest single packet (one line of json) the server will take
+MAX_PACKET = 1 << 20
+# how much can be waiting to go out to a client before they're assumed to be stuck and dropped
+MAX_BUFFERED = 16 << 20
+
+STORE = PacketStore("queued_packets.db")
+STORE.migrate("queued_packets.json")
+
+def decode(data):
     try:
-        print(data)
-        data = json.loads(data.decode("utf-8"))
-    except json.decoder.JSONDecodeError:
+        return json.loads(data.decode("utf-8"))
+    except (json.decoder.JSONDecodeError, UnicodeDecodeError):
         print("JSON decode error")
         return None
-    return data
 
-def handle_client(conn):
-    with conn:
+# everyone connected right now, by whoami
+ONLINE = {}
+# held while giving packets ids and sending them, so each player always gets their packets in id order
+ONLINE_LOCK = threading.RLock()
+
+def deliver(packet):
+    """Queue `packet`, and send it straight away if who it's for is online"""
+    with ONLINE_LOCK:
+        packet = dict(packet, id=STORE.enqueue(packet))
+        session = ONLINE.get(packet["player"])
+        # clients that don't ack only ever read their queue when they connect
+        if session is not None and session.acks:
+            try:
+                session.send([packet])
+            except OSError:
+                pass # they've just gone, it's still in their queue for next time
+
+class Session:
+    """
+    One connected player. Their queue is sent when they connect, again
+    whenever they ask with {"sync": true}, and packets sent to them while
+    they're connected are pushed to them as they come in. Everything sent is
+    a list of packets, as a line of json, or as a frame if the client said
+    "framing": "binary" in its whoami (several frames if it won't fit in one).
+
+    Clients that say {"acks": true} when they connect, or that send
+    {"ack": id}, are trusted to ack everything themselves. The first clients
+    that said {"acks": true} get is {"store": uid}, so they can tell when the
+    store's been replaced and the ids have started again. Otherwise the
+    queue counts as acknowledged as soon as they send anything else, as the
+    client reads the whole queue before doing anything else.
+    """
+    def __init__(self, whoami, send, acks=False):
+        self.whoami = whoami
+        self.send = send # sends a message to the player, called with ONLINE_LOCK held so it should be quick
+        self.acks = acks
+        self.delivered = None # id of the last packet sent, if it's to be acked implicitly
+
+    def send_queue(self):
+        with ONLINE_LOCK:
+            packets = STORE.pending(self.whoami)
+            if packets and not self.acks:
+                self.delivered = packets[-1]["id"]
+            self.send(packets)
+
+    def connect(self):
+        """Send the player their queue, and start pushing packets to them. If they're
+        already connected somewhere else, this connection takes over"""
+        with ONLINE_LOCK:
+            ONLINE[self.whoami] = self
+            if self.acks:
+                self.send({"store": STORE.uid})
+            self.send_queue()
+
+    def disconnect(self):
+        with ONLINE_LOCK:
+            if ONLINE.get(self.whoami) is self:
+                del ONLINE[self.whoami]
+
+    def handle(self, req):
+        """Deal with a packet from the player. Returns False once they've said they're done"""
+        if type(req) == dict and "ack" in req:
+            STORE.ack(self.whoami, req["ack"])
+            self.acks = True
+            self.delivered = None
+            return True
+
+        if self.delivered is not None:
+            STORE.ack(self.whoami, self.delivered)
+            self.delivered = None
+        if type(req) == str and req == "exit":
+            return False
+        if type(req) != dict:
+            print(f"Unknown packet from {self.whoami}")
+        elif "sync" in req:
+            self.send_queue()
+        elif "player" in req:
+            deliver(req)
+        else:
+            print(f"Packet from {self.whoami} has no player")
+        return True
+
+def recv_data(f):
+    """Next packet from `f`, a file made from the socket with `makefile("rb")`"""
+    return decode(f.readline(MAX_PACKET))
+
+def recv_frame(f):
+    """Same as `recv_data`, for clients that talk in frames (see wire.py)"""
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    length, kind = HEADER.unpack(header)
+    if length > MAX_FRAME:
+        print("Packet too long")
+        return None
+    payload = f.read(length)
+    if len(payload) < length:
+        return None
+    try:
+        return decode_frame(kind, payload)
+    except ValueError as e:
+        print(e)
+        return None
+
+class Sender:
+    """
+    Sends to one client from a thread of its own, so `send` never blocks and a
+    client that stops reading only holds itself up, rather than everyone
+    waiting on ONLINE_LOCK behind it. Like the asyncio server, a client with
+    more than MAX_BUFFERED waiting to go out to it is dropped.
+    """
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.addr = addr
+        self.queue = queue.Queue()
+        self.buffered = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def send(self, data):
+        with self.lock:
+            if self.closed:
+                return
+            self.buffered += len(data)
+            if self.buffered > MAX_BUFFERED:
+                print(f"{self.addr} isn't reading what's sent to it, disconnecting")
+                self.abort() # anything not acked will still be in their queue
+                return
+        self.queue.put(data)
+
+    def abort(self):
+        # wakes up both a stuck sendall and the reading thread
+        self.closed = True
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            try:
+                self.conn.sendall(data)
+            except OSError:
+                with self.lock:
+                    self.abort()
+                return
+            with self.lock:
+                self.buffered -= len(data)
+
+    def close(self, timeout=5):
+        """Send whatever's left (giving up after `timeout` seconds), then stop"""
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+def handle_client(conn, addr):
+    with conn, conn.makefile("rb") as f:
         print(f"Connected by {addr}")
-        whoami = recv_data(conn)
-        if not whoami or not whoami.get("whoami"):
+        whoami = recv_data(f)
+        if not whoami or type(whoami) != dict or not whoami.get("whoami"):
             print("Invalid start packet, disconnecting")
             return
 
-        whoami = whoami.get("whoami")
-        print(f"{addr} identified as {whoami}")
+        binary = whoami.get("framing") == FRAMING
+        encode = encode_frames if binary else encode_line
+        sender = Sender(conn, addr)
+        session = Session(whoami.get("whoami"), lambda message: sender.send(encode(message)), whoami.get("acks", False))
+        print(f"{addr} identified as {session.whoami}")
+        try:
+            session.connect()
+            while True:
+                try:
+                    req = recv_frame(f) if binary else recv_data(f)
+                except OSError:
+                    break
+                if not req or not session.handle(req):
+                    break
+        finally:
+            session.disconnect()
+            sender.close()
 
-        queue = player_queues.get(whoami, [])
-        conn.send(json.dumps(queue).encode("utf-8") + b"\n")
-        player_queues[whoami] = [] # assume everything went smoothly...
+def run_threaded(port=7896):
+    """The old one thread per connection server"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("0.0.0.0", port))
+        s.listen()
+        while True:
+            conn, addr = s.accept()
+            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+
+async def read_packet(reader):
+    """Next newline terminated packet from `reader`, or None if the client went away or sent rubbish"""
+    try:
+        line = await reader.readline()
+    except (asyncio.LimitOverrunError, ValueError):
+        print("Packet too long")
+        return None
+    except ConnectionError:
+        return None
+    if not line:
+        return None
+    return decode(line)
+
+async def read_frame(reader):
+    """Same as `read_packet`, for clients that talk in frames (see wire.py)"""
+    try:
+        length, kind = HEADER.unpack(await reader.readexactly(HEADER.size))
+        if length > MAX_FRAME:
+            print("Packet too long")
+            return None
+        return decode_frame(kind, await reader.readexactly(length))
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    except ValueError as e:
+        print(e)
+        return None
+
+async def handle_client_async(reader, writer):
+    addr = writer.get_extra_info("peername")
+    print(f"Connected by {addr}")
+    session = None
+    try:
+        whoami = await read_packet(reader)
+        if not whoami or type(whoami) != dict or not whoami.get("whoami"):
+            print("Invalid start packet, disconnecting")
+            return
+
+        binary = whoami.get("framing") == FRAMING
+        encode = encode_frames if binary else encode_line
+        loop = asyncio.get_running_loop()
+        def write(data):
+            if writer.transport.is_closing():
+                return
+            writer.write(data)
+            if writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+                print(f"{addr} isn't reading what's sent to it, disconnecting")
+                writer.transport.abort() # anything not acked will still be in their queue
+        # everything the session does runs in a worker thread (the store syncs to disk,
+        # so that's kept off the event loop), so hand writes back to the loop
+        session = Session(whoami.get("whoami"), lambda message: loop.call_soon_threadsafe(write, encode(message)), whoami.get("acks", False))
+        print(f"{addr} identified as {session.whoami}")
+        await asyncio.to_thread(session.connect)
 
         while True:
-            req = recv_data(conn)
-            if not req or (type(req) == str and req == "exit"):
+            req = await (read_frame(reader) if binary else read_packet(reader))
+            if not req or not await asyncio.to_thread(session.handle, req):
                 break
-            player = req["player"]
-            if not player in player_queues:
-                player_queues[player] = []
-            player_queues[player].append(req)
-
-            with open("queued_packets.json", "w") as f:
-                f.write(json.dumps(player_queues))
-
-with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    s.bind(("0.0.0.0", 7896))
-    s.listen()
-    threads = []
-    while True:
-        conn, addr = s.accept()
-        t = threading.Thread(target=handle_client, args=(conn,))
-        t.start()
-        threads.append(t)
-            
+    except ConnectionError:
+        pass
+    finally:
+        if session is not None:
+            session.disconnect()
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+async def serve(port=7896):
+    """Relay every client on the one event loop, rather than a thread each"""
+    server = await asyncio.start_server(handle_client_async, "0.0.0.0", port, limit=MAX_PACKET)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    if "--threaded" in sys.argv:
+        run_threaded()
+    else:
+        asyncio.run(serve())
@@ -1,7 +1,11 @@
-from src.main import calc_income, calc_employment
+import sys
+import copy
+from concurrent.futures import ProcessPoolExecutor
+sys.path.append("src")
 # from PyQt5 import QtWidgets
-from src.building import *
-from src.constants import *
+from building import *
+from constants import *
+from aggregates import reduce_by
 
 # class Day(QtWidgets.QWidget):
 #     def __init__(self, parent=None):
@@ -30,20 +34,37 @@ import datetime
 d = datetime.date.today()
 
 class Economy:
+    """
+    Headless version of the economy for trying out strategies. Buildings are
+    kept as (Building, count) pairs and the population, jobs and gross income
+    are kept as running totals, so a day costs the same however much farmland
+    there is.
+    """
     def __init__(self, buildings=None, balance=40000, loans=None):
-        if buildings is None:
-            self.buildings = []
-        else:
-            self.buildings = buildings
+        self.buildings = []
         if loans is None:
             self.loans = []
         else:
             self.loans = loans
 
+        self.pop = 0
+        self.jobs = 0
+        self.gross_income = 0
         self.bal = balance
+        for building in buildings or []:
+            self._count(building)
 
-    def add_building(self, building):
+    def _count(self, building):
         self.buildings.append(building)
+        b, count = building
+        if b.btype == BType.HOUSE:
+            self.pop += b.size * b.count * count
+        else:
+            self.jobs += b.employees() * count
+        self.gross_income += b.income() * count
+
+    def add_building(self, building):
+        self._count(building)
         self.bal -= building[0].cost() * building[1]
 
     def add_building2(self, btype, count=1, size=None):
@@ -61,24 +82,26 @@ class Economy:
         self.bal -= amt
 
     def income(self):
-        return calc_income(self.get_data())[0]
+        return reduce_by(self.gross_income, self.employ())
 
     def employ(self):
-        return calc_employment(self.get_data())
-        
-    def get_data(self):
-        buildings = []
-        for b in self.buildings:
-            for i in range(b[1]):
-                buildings.append(b[0])
-        
-        return {"regions": {"a": {"buildings": buildings}}}
-
-    def day(self):
+        return self.jobs / self.pop if self.pop != 0 else 0
+
+    def apply(self, action):
+        """Do one step of a plan: ("build", btype, count, size), ("loan", amount, rate) or ("pay", loan index, amount)"""
+        if action[0] == "build":
+            self.add_building2(*action[1:])
+        elif action[0] == "loan":
+            self.add_loan([action[1], action[2]])
+        elif action[0] == "pay":
+            self.pay_for_loan(action[1], action[2])
+
+    def day(self, verbose=True):
         income = self.income()
         employment = self.employ()
         oldbal = self.bal
-        print(f"Bal: {self.bal:.2f}, Emp: {employment:.4f}, Inc: {income:.2f}, Exc: {oldbal + income:.2f}")
+        if verbose:
+            print(f"Bal: {self.bal:.2f}, Emp: {employment:.4f}, Inc: {income:.2f}, Exc: {oldbal + income:.2f}")
         self.bal += income
         if self.bal < 0:
             self.bal += self.bal * OVERDRAFT_INTEREST
@@ -95,6 +118,33 @@ class Economy:
     def lorentz(self):
         return Building.get_lorentz(self.income())
 
+def fitness(eco):
+    return eco.income() if eco.bal - eco.get_loans() > 0 else 0
+
+def run_plan(start, plan, score=fitness):
+    """Run `plan` (a list of days, each a list of actions for `Economy.apply`) on a copy of `start`.
+    Returns (score, balance, income, outstanding loans) at the end"""
+    eco = copy.deepcopy(start)
+    for actions in plan:
+        for action in actions:
+            eco.apply(action)
+        eco.day(verbose=False)
+    return score(eco), eco.bal, eco.income(), eco.get_loans()
+
+def _run_plan(args):
+    return run_plan(*args)
+
+def evaluate_plans(start, plans, score=fitness, processes=None):
+    """Run every plan from `start` across a process pool. `score` has to be a module level
+    function so it can be sent to the workers.
+    Returns [(score, balance, income, loans, plan index)], best first"""
+    jobs = [(start, plan, score) for plan in plans]
+    with ProcessPoolExecutor(processes) as pool:
+        results = list(pool.map(_run_plan, jobs, chunksize=max(1, len(jobs) // 64)))
+    ranked = [(*result, i) for i, result in enumerate(results)]
+    ranked.sort(key=lambda r: -r[0])
+    return ranked
+
 """
 things_to_build = [(Building(FARMING, d), 50)] * 32 + [
     (Building(FARMING, d), 19),
@@ -143,53 +193,54 @@ print(len(things_to_build))
 print(fitness(0))
 """
 
-eco = Economy(buildings=[
-    (Building(BType.AIRPORT, d, 1, 100), 1),
-    (Building(BType.AIRPORT, d, 1, 109), 1),
-    (Building(BType.AIRPORT, d, 1, 90), 1),
-    (Building(BType.HOUSE, d, 1, 4), 10),
-    (Building(BType.HOUSE, d, 1, 2), 2),
-    (Building(BType.MARKET_STALL, d, 1), 1),
-    (Building(BType.POLICE_STATION, d, 1), 1),
-    (Building(BType.HOSPITAL, d, 1), 1),
-    (Building(BType.POST_OFFICE, d, 1), 1),
-    (Building(BType.OFFICE, d, 1), 13),
-    (Building(BType.FARMING, d, 1), 1919),
-], balance=-3510.0)
-
-
-def weird_one():
-    eco.add_loan([3000, 0.02])
-    eco.add_building((Building(BType.HOUSE, d, eco.lorentz(), 4), 1))
-    # print(f"Bal: {eco.bal:.2f}, Emp: {eco.employ():.2f}, Inc: {eco.income():.2f}")
-    eco.day()
-    eco.add_building2(BType.HOUSE, 1, 2)
-    eco.pay_for_loan(0, 3000*1.02)
-    eco.day()
-    eco.add_building2(BType.HOUSE, 1, 1)
-    eco.add_building2(BType.FARMING, 357)
-    eco.day() # 3
-    eco.add_loan([1000, 0.02])
-    eco.add_building2(BType.POLICE_STATION, 1)
-    eco.add_building2(BType.HOUSE, 1, 2)
-    eco.day()
-    eco.add_building2(BType.HOUSE, 1, 2)
-    eco.add_building2(BType.OFFICE, 1)
-    eco.pay_for_loan(0, 1000*1.02)
-    eco.day()
-
-    print("7th:")
-    eco.add_building2(BType.RAILWAY_STATION, 2)
-    eco.add_building2(BType.FARMING, 80)
-    eco.day()
-    eco.add_building2(BType.HOUSE, 1, 6)
-    eco.day()
-    eco.add_building2(BType.RAILWAY_STATION, 1)
-    eco.add_building2(BType.METRO_STATION, 3)
-    eco.day()
-    eco.add_building2(BType.HOUSE, 1, 4)
-    eco.add_building2(BType.FARMING, 82)
-    eco.day()
-
-weird_one()
-print(eco.income(), eco.bal - eco.get_loans())
\ No newline at end of file
+if __name__ == "__main__":
+    eco = Economy(buildings=[
+        (Building(BType.AIRPORT, d, 1, 100), 1),
+        (Building(BType.AIRPORT, d, 1, 109), 1),
+        (Building(BType.AIRPORT, d, 1, 90), 1),
+        (Building(BType.HOUSE, d, 1, 4), 10),
+        (Building(BType.HOUSE, d, 1, 2), 2),
+        (Building(BType.MARKET_STALL, d, 1), 1),
+        (Building(BType.POLICE_STATION, d, 1), 1),
+        (Building(BType.HOSPITAL, d, 1), 1),
+        (Building(BType.POST_OFFICE, d, 1), 1),
+        (Building(BType.OFFICE, d, 1), 13),
+        (Building(BType.FARMING, d, 1), 1919),
+    ], balance=-3510.0)
+
+
+    def weird_one():
+        eco.add_loan([3000, 0.02])
+        eco.add_building((Building(BType.HOUSE, d, eco.lorentz(), 4), 1))
+        # print(f"Bal: {eco.bal:.2f}, Emp: {eco.employ():.2f}, Inc: {eco.income():.2f}")
+        eco.day()
+        eco.add_building2(BType.HOUSE, 1, 2)
+        eco.pay_for_loan(0, 3000*1.02)
+        eco.day()
+        eco.add_building2(BType.HOUSE, 1, 1)
+        eco.add_building2(BType.FARMING, 357)
+        eco.day() # 3
+        eco.add_loan([1000, 0.02])
+        eco.add_building2(BType.POLICE_STATION, 1)
+        eco.add_building2(BType.HOUSE, 1, 2)
+        eco.day()
+        eco.add_building2(BType.HOUSE, 1, 2)
+        eco.add_building2(BType.OFFICE, 1)
+        eco.pay_for_loan(0, 1000*1.02)
+        eco.day()
+
+        print("7th:")
+        eco.add_building2(BType.RAILWAY_STATION, 2)
+        eco.add_building2(BType.FARMING, 80)
+        eco.day()
+        eco.add_building2(BType.HOUSE, 1, 6)
+        eco.day()
+        eco.add_building2(BType.RAILWAY_STATION, 1)
+        eco.add_building2(BType.METRO_STATION, 3)
+        eco.day()
+        eco.add_building2(BType.HOUSE, 1, 4)
+        eco.add_building2(BType.FARMING, 82)
+        eco.day()
+
+    weird_one()
+    print(eco.income(), eco.bal - eco.get_loans())
\ No newline at end of file
@@ -0,0 +1,88 @@
+from constants import BType
+from kernel import economy_totals
+
+def reduce_by(income, employment):
+    return income / employment if employment >= 1 else income * employment
+
+class Aggregates:
+    """
+    Running totals of population, jobs and gross income, both per region
+    and for the whole country. `Data` keeps these up to date as buildings
+    are bought and sold and regions come and go, so reading them is O(1)
+    instead of walking every building like `calc_income` and friends do.
+    """
+    def __init__(self):
+        self.population = 0
+        self.jobs = 0
+        self.gross_income = 0
+        self.regional_population = {}
+        self.regional_jobs = {}
+        self.regional_gross_income = {}
+
+    def rebuild(self, regions):
+        """Throw away the running totals and recount them from `regions`"""
+        self.__init__()
+        for region, (population, jobs, gross_income) in economy_totals(regions).items():
+            self.regional_population[region] = population
+            self.regional_jobs[region] = jobs
+            self.regional_gross_income[region] = gross_income
+            self.population += population
+            self.jobs += jobs
+            self.gross_income += gross_income
+
+    def add_region(self, region):
+        self.regional_population[region] = 0
+        self.regional_jobs[region] = 0
+        self.regional_gross_income[region] = 0
+
+    def remove_region(self, region):
+        self.population -= self.regional_population.pop(region)
+        self.jobs -= self.regional_jobs.pop(region)
+        self.gross_income -= self.regional_gross_income.pop(region)
+
+    def add_building(self, region, building, sign=1):
+        """Add `building` (all `building.count` of it) to the totals. Use sign=-1 when it's sold"""
+        if building.btype == BType.HOUSE:
+            people = building.size * building.count * sign
+            self.population += people
+            self.regional_population[region] += people
+        else:
+            jobs = building.employees() * sign
+            self.jobs += jobs
+            self.regional_jobs[region] += jobs
+
+        income = building.income() * sign
+        self.gross_income += income
+        self.regional_gross_income[region] += income
+
+    def remove_building(self, region, building):
+        self.add_building(region, building, sign=-1)
+
+    def employment(self):
+        return self.jobs / self.population if self.population != 0 else 0
+
+    def project(self, deltas, balance):
+        """Work out what buying the buildings in `deltas` would do, without changing anything.
+        A building with a negative count is treated as being sold.
+        Returns the projected (balance, income, employment)"""
+        population, jobs, gross_income = self.population, self.jobs, self.gross_income
+        for building in deltas:
+            if building.btype == BType.HOUSE:
+                population += building.size * building.count
+            else:
+                jobs += building.employees()
+            gross_income += building.income()
+            balance -= building.cost()
+
+        employment = jobs / population if population != 0 else 0
+        return balance, reduce_by(gross_income, employment), employment
+
+    def income(self):
+        return reduce_by(self.gross_income, self.employment())
+
+    def region_income(self, region):
+        return reduce_by(self.regional_gross_income[region], self.employment())
+
+    def regional_income(self):
+        employment = self.employment()
+        return {r: reduce_by(i, employment) for r, i in self.regional_gross_income.items()}
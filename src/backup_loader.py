@@ -0,0 +1,70 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from economy_data import Data
+
+# below this many files it's quicker to just load them here than to start up the pool.
+# Each spawned worker re-imports main (so PyQt5 and matplotlib), which is about a second
+# before it loads anything, against roughly 7ms a file to load them here. Even on 4 cores
+# that's only won back at 200 odd files, and with one core it never is
+POOL_MIN_FILES = 250
+
+def load_backup(fname):
+    data = Data()
+    data.read_from_file(fname)
+    return data
+
+def file_key(fname):
+    stat = os.stat(fname)
+    return stat.st_mtime_ns, stat.st_size
+
+class BackupLoader:
+    """
+    Loads backups without blocking on each one in turn: old style full
+    backups are loaded in a process pool, and everything loaded is kept
+    (keyed by file mtime and size) so unchanged backups are never loaded
+    twice. Never shows any dialogs, so it's safe to use headless.
+    """
+    def __init__(self):
+        self.files = {} # fname -> (file_key, Data)
+        self.stores = {} # fname -> (file_key, offset, state, [Data])
+
+    def load_files(self, fnames):
+        """Load each of `fnames`, returning a list of `Data` in the same order"""
+        todo = [f for f in fnames if not f in self.files or self.files[f][0] != file_key(f)]
+        if len(todo) >= POOL_MIN_FILES and (os.cpu_count() or 1) > 1:
+            # spawn rather than fork: this gets called from the compute worker, and
+            # forking while other threads are running can deadlock the child
+            with ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn")) as pool:
+                loaded = list(pool.map(load_backup, todo, chunksize=max(1, len(todo) // (4 * (os.cpu_count() or 1)))))
+        else:
+            loaded = [load_backup(f) for f in todo]
+
+        for fname, data in zip(todo, loaded):
+            self.files[fname] = (file_key(fname), data)
+        return [self.files[f][1] for f in fnames]
+
+    def load_store(self, store):
+        """Load every day in a `BackupStore`, oldest first. Only days added since last time get loaded"""
+        if not os.path.isfile(store.fname):
+            return []
+        key = file_key(store.fname)
+        offset, state, datas = 0, None, []
+        if store.fname in self.stores:
+            old_key, old_offset, old_state, old_datas = self.stores[store.fname]
+            if old_key == key:
+                return list(old_datas)
+            if key[1] > old_key[1]:
+                # the store is append only, so carry on from where we got to last time
+                offset, state, datas = old_offset, old_state, old_datas
+
+        for state, offset in store.states(offset, state):
+            data = Data()
+            data.deserialise(store.to_raw(state))
+            if datas and datas[-1].current_day == data.current_day:
+                datas[-1] = data # backed up twice in one day, the later one wins
+            else:
+                datas.append(data)
+
+        self.stores[store.fname] = (key, offset, state, datas)
+        return list(datas)
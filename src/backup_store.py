@@ -0,0 +1,169 @@
+import json
+import os
+
+class BackupStore:
+    """
+    Daily backups kept as a single append-only file: the first line is a full
+    snapshot, every line after that is just what changed since the day before
+    (buildings added/removed per region, transactions appended, loans etc.).
+    Any day can be rebuilt by replaying the deltas up to it.
+
+    The days come out as the same dicts `Data.serialise` produces, so turning
+    one back into a `Data` is just `Data.deserialise`.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.last = None # state of the newest day in the store, see `state`
+
+    def state(self, data):
+        """Snapshot of `data` in a form that's easy to diff. Regions are {(btype, size, lorentz): count}"""
+        regions = {}
+        for name, store in data.regions.items():
+            counts = {}
+            for btype, size, lorentz, count in zip(store.btypes, store.sizes, store.lorentzes, store.counts):
+                counts[(btype, size, lorentz)] = counts.get((btype, size, lorentz), 0) + count
+            regions[name] = counts
+
+        return {"current_day": data.current_day.isoformat(),
+                "regions": regions,
+                "transactions": [data.serialise_transaction(t) for t in data.transactions],
+                "loans": [data.serialise_loan(l) for l in data.loans],
+                "given_loans": [data.serialise_loan(l) for l in data.given_loans],
+                "future_packets": list(data.future_packets)}
+
+    def _records(self, offset=0):
+        """Yield (record, offset just past it) for every record from `offset` on"""
+        if not os.path.isfile(self.fname):
+            return
+        with open(self.fname, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                yield json.loads(line), offset
+
+    def _apply(self, state, record):
+        """Apply one line of the file to `state` (None before the first line), returning the new state"""
+        if "base" in record:
+            state = record["base"]
+            state["regions"] = {r: {tuple(b[:3]): b[3] for b in rows} for r, rows in state["regions"].items()}
+            return state
+
+        for region in record.get("removed_regions", []):
+            del state["regions"][region]
+        for region, change in record.get("regions", {}).items():
+            counts = state["regions"].setdefault(region, {})
+            for b in change.get("remove", []):
+                counts[tuple(b[:3])] -= b[3]
+                if counts[tuple(b[:3])] == 0:
+                    del counts[tuple(b[:3])]
+            for b in change.get("add", []):
+                counts[tuple(b[:3])] = counts.get(tuple(b[:3]), 0) + b[3]
+
+        if "transactions" in record:
+            del state["transactions"][record["transactions_kept"]:]
+            state["transactions"].extend(record["transactions"])
+        for key in ("current_day", "loans", "given_loans", "future_packets"):
+            if key in record:
+                state[key] = record[key]
+        return state
+
+    def _delta(self, old, new):
+        record = {"day": new["current_day"]}
+        removed = [r for r in old["regions"] if not r in new["regions"]]
+        if removed:
+            record["removed_regions"] = removed
+
+        regions = {}
+        for region, counts in new["regions"].items():
+            old_counts = old["regions"].get(region, {})
+            add = [[*k, c - old_counts.get(k, 0)] for k, c in counts.items() if c > old_counts.get(k, 0)]
+            remove = [[*k, c - counts.get(k, 0)] for k, c in old_counts.items() if c > counts.get(k, 0)]
+            if add or remove or not region in old["regions"]:
+                regions[region] = {"add": add, "remove": remove}
+        if regions:
+            record["regions"] = regions
+
+        # transactions are nearly always just appended to, but one could have been deleted
+        kept = 0
+        old_trans, new_trans = old["transactions"], new["transactions"]
+        while kept < len(old_trans) and kept < len(new_trans) and old_trans[kept] == new_trans[kept]:
+            kept += 1
+        if kept != len(old_trans) or kept != len(new_trans):
+            record["transactions_kept"] = kept
+            record["transactions"] = new_trans[kept:]
+
+        for key in ("current_day", "loans", "given_loans", "future_packets"):
+            if old[key] != new[key]:
+                record[key] = new[key]
+        return record
+
+    def to_raw(self, state):
+        return {"current_day": state["current_day"],
+                "regions": {r: {"buildings": [[*k, c] for k, c in counts.items()]} for r, counts in state["regions"].items()},
+                "transactions": list(state["transactions"]),
+                "loans": state["loans"],
+                "given_loans": state["given_loans"],
+                "future_packets": state["future_packets"]}
+
+    def append(self, data):
+        """Back up `data` as of its current day"""
+        self.append_state(self.state(data))
+
+    def append_state(self, new):
+        """Back up a `state` taken earlier. This doesn't need the data, so it can be done on another thread"""
+        if self.last is None:
+            for state, _ in self.states():
+                self.last = state
+
+        if self.last is None:
+            base = dict(new)
+            base["regions"] = {r: [[*k, c] for k, c in counts.items()] for r, counts in new["regions"].items()}
+            record = {"day": new["current_day"], "base": base}
+        else:
+            record = self._delta(self.last, new)
+
+        with open(self.fname, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        # `new` shares lists with `data`, so take the copy that went to disk
+        self.last = self._apply(self.last, json.loads(json.dumps(record)))
+
+    def matches(self, data):
+        """Whether the newest day in the store is exactly `data`"""
+        return self.last is not None and self.last == self.state(data)
+
+    def states(self, offset=0, state=None):
+        """Yield (state, offset) after each record in the file. As the file is only ever
+        appended to, passing in the last offset and state carries on from where that left off.
+        The state is updated in place, use `to_raw` to get a copy of it in the usual format"""
+        for record, offset in self._records(offset):
+            state = self._apply(state, record)
+            yield state, offset
+
+    def days(self):
+        """Every day in the store, oldest first"""
+        days = []
+        for record, _ in self._records():
+            if not days or days[-1] != record["day"]:
+                days.append(record["day"])
+        return days
+
+    def stream(self):
+        """Yield (day, raw data) for every day in the store, oldest first.
+        If a day was backed up more than once, only the last one is given"""
+        prev = None
+        for state, _ in self.states():
+            if prev is not None and prev[0] != state["current_day"]:
+                yield prev
+            prev = (state["current_day"], self.to_raw(state))
+        if prev is not None:
+            yield prev
+
+    def load(self, day):
+        """Raw data for `day` (an iso date), or None if it wasn't backed up"""
+        raw = None
+        for state_day, state in self.stream():
+            if state_day == day:
+                raw = state
+            elif state_day > day:
+                break
+        return raw
@@ -3,6 +3,10 @@ from typing import Union
 import datetime
 
 class Building:
+    # there can be a lot of these (every building in every transaction of every backup), and
+    # they're never changed once made, so deserialising shares identical ones, see `intern_building`
+    __slots__ = ("btype", "size", "date", "lorentz", "count")
+
     def __init__(self, btype: int, date: datetime.date, lorentz: int, size: int=None, count: int=1):
         self.btype = btype
         self.size = size
@@ -37,7 +41,7 @@ class Building:
     def employees(self) -> int:
         #annoying hack to make airports bought before some date employ 6 people
         if self.btype == BType.AIRPORT:
-            if self.date < datetime.date(2022, 10, 20):
+            if self.date < AIRPORT_CUTOFF:
                 return 6 * self.count
             return self.size / 20 * self.count
         return BUILDING_INFO[self.btype].employees * self.count
@@ -61,3 +65,24 @@ class Building:
     def is_roughly(self, other):
         return type(self) == type(other) and self.btype == other.btype and self.size == other.size
 
+    def __reduce__(self):
+        # backups are loaded in other processes, this way they come back shared too
+        return intern_building, (self.btype, self.date, self.lorentz, self.size, self.count)
+
+# (btype, size, lorentz, date bucket, count) -> Building
+INTERNED = {}
+
+def date_bucket(btype, date):
+    """All that a building's date changes is how many an airport employs, so two
+    buildings with dates in the same bucket behave exactly the same"""
+    return date < AIRPORT_CUTOFF if btype == BType.AIRPORT else None
+
+def intern_building(btype, date, lorentz, size=None, count=1):
+    """Same as `Building(...)`, except that the same building is given back for every identical
+    one (its date might be a different day in the same `date_bucket`). Don't change it!"""
+    key = (btype, size, lorentz, date_bucket(btype, date), count)
+    building = INTERNED.get(key)
+    if building is None:
+        building = INTERNED[key] = Building(btype, date, lorentz, size, count=count)
+    return building
+
@@ -1,107 +1,131 @@
-from PyQt5 import QtWidgets, Qt
+from PyQt5 import QtWidgets, QtCore, Qt
 from data import format_money
 
-# TODO make this better
-class BuildingEntry(Qt.QObject):
-    decrease = Qt.pyqtSignal()
-    def __init__(self, building, count, parent):
-        super().__init__()
+class BuildingGroup:
+    """All the buildings of one type and size, shown as one row. `building` is a single one of them (count 1)"""
+    def __init__(self, building, count):
         self.building = building
         self.count = count
 
-        self.l_type = QtWidgets.QLabel(building.name(), parent)
-        self.l_count = QtWidgets.QLabel(parent)
-        self.l_employed = QtWidgets.QLabel(parent)
-        self.l_income = QtWidgets.QLabel(parent)
-        self.l_cost = QtWidgets.QLabel(parent)
-        self.b_decrease = QtWidgets.QPushButton("-", parent)
-        
-        self.b_decrease.clicked.connect(lambda: self.decrease.emit())
-        width = self.b_decrease.fontMetrics().boundingRect("-").width() + 7
-        self.b_decrease.setMaximumWidth(width)
-        self.b_decrease.setMaximumHeight(width) # square
-        self.update_count(self.count)
-        
-    def update_count(self, count):
-        self.l_cost.setText(format_money(self.building.cost() * count))
-        self.l_count.setText(str(count))
-        self.l_income.setText(format_money(self.building.wage() * self.building.employees() * count * 8))
-        self.l_employed.setText(str(round(self.building.employees() * count, 3)))
-        self.count = count
-        
-    def remove(self, layout):
-        layout.removeWidget(self.l_type)
-        layout.removeWidget(self.l_count)
-        layout.removeWidget(self.l_employed)
-        layout.removeWidget(self.l_income)
-        layout.removeWidget(self.l_cost)
-        layout.removeWidget(self.b_decrease)
-        self.l_type.deleteLater()
-        self.l_count.deleteLater()
-        self.l_employed.deleteLater()
-        self.l_income.deleteLater()
-        self.l_cost.deleteLater()
-        self.b_decrease.deleteLater()
-        self.l_type = None
-        self.l_count = None
-        self.l_employed = None
-        self.l_income = None
-        self.l_cost = None
-        self.b_decrease = None
-        
-    def insert(self, layout, idx):
-        layout.addWidget(self.l_type, idx, 0)
-        layout.addWidget(self.l_count, idx, 1)
-        layout.addWidget(self.l_employed, idx, 2)
-        layout.addWidget(self.l_income, idx, 3)
-        layout.addWidget(self.l_cost, idx, 4)
-        layout.addWidget(self.b_decrease, idx, 5)
-
-class BuildingList(QtWidgets.QWidget):
-    building_count_decrease = Qt.pyqtSignal(BuildingEntry)
+    def key(self):
+        return (self.building.btype, self.building.size)
+
+class BuildingModel(QtCore.QAbstractTableModel):
+    """
+    Table model of `BuildingGroup`s. Only what's on screen gets asked for,
+    and `set_groups` works out which rows actually changed rather than
+    starting again, so the view only redraws those.
+    """
+    HEADERS = ["Building type", "Count", "Employed", "Income", "Cost", ""]
+    SELL_COLUMN = 5
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.layout = QtWidgets.QGridLayout(self)
-        self.setLayout(self.layout)
-        self.index = 0
-        self.items = []
-        self.l_type = QtWidgets.QLabel("Bulding type")
-        self.l_count = QtWidgets.QLabel("Count")
-        self.l_employed = QtWidgets.QLabel("Employed")
-        self.l_income = QtWidgets.QLabel("Income")
-        self.l_cost = QtWidgets.QLabel("Cost")
-        
-        self.layout.addWidget(self.l_type, 0, 0)
-        self.layout.addWidget(self.l_count, 0, 1)
-        self.layout.addWidget(self.l_employed, 0, 2)
-        self.layout.addWidget(self.l_income, 0, 3)
-        self.layout.addWidget(self.l_cost, 0, 4)
-
-    def add_building(self, building, count):
-        item = BuildingEntry(building, count, self)
-        self.items.append(item)
-        idx = len(self.items)
-        item.insert(self.layout, idx)
-        item.decrease.connect(lambda: self.building_count_decrease.emit(item))
-    
-    def remove_building(self, building):
-        item = None
-        for n in self.items:
-            if n.building.is_roughly(building):
-                item = n
-        if item != None:
-            item.remove(self.layout)
-            self.items.remove(item)
+        self.groups = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.groups)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        col = index.column()
+        if role == QtCore.Qt.DisplayRole:
+            return self._display(self.groups[index.row()], col)
+        elif role == QtCore.Qt.ToolTipRole and col == self.SELL_COLUMN:
+            return "Sell"
+        elif role == QtCore.Qt.TextAlignmentRole and col == self.SELL_COLUMN:
+            return QtCore.Qt.AlignCenter
+        return None
+
+    def _display(self, group, col):
+        b = group.building
+        if col == 0:
+            return b.name()
+        elif col == 1:
+            return str(group.count)
+        elif col == 2:
+            return str(round(b.employees() * group.count, 3))
+        elif col == 3:
+            return format_money(b.wage() * b.employees() * group.count * 8)
+        elif col == 4:
+            return format_money(b.cost() * group.count)
+        elif col == self.SELL_COLUMN:
+            return "-"
+        return None
+
+    def _row(self, group):
+        """Everything shown in `group`'s row"""
+        return [self._display(group, col) for col in range(len(self.HEADERS))]
+
+    def set_groups(self, groups):
+        """Show `groups` instead. Groups that are still there keep their row, and only get
+        redrawn if something shown in it changed. Gone ones are removed and new ones go on the end"""
+        new = {g.key(): g for g in groups}
+        for row in range(len(self.groups) - 1, -1, -1):
+            if not self.groups[row].key() in new:
+                self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+                del self.groups[row]
+                self.endRemoveRows()
+
+        for row, group in enumerate(self.groups):
+            updated = new.pop(group.key())
+            self.groups[row] = updated
+            if self._row(updated) != self._row(group):
+                self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+
+        if new:
+            self.beginInsertRows(QtCore.QModelIndex(), len(self.groups), len(self.groups) + len(new) - 1)
+            self.groups.extend(new.values())
+            self.endInsertRows()
+
+    def update_group(self, key, group):
+        """Bring the row for `key` ((btype, size)) up to date with `group`, which is None if there's none left"""
+        row = next((r for r, g in enumerate(self.groups) if g.key() == key), None)
+        if row is None:
+            if group is not None:
+                self.beginInsertRows(QtCore.QModelIndex(), len(self.groups), len(self.groups))
+                self.groups.append(group)
+                self.endInsertRows()
+        elif group is None:
+            self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+            del self.groups[row]
+            self.endRemoveRows()
         else:
-            raise RuntimeWarning("BuildingList.remove_building called on non-existent building")
-
-    def update_building(self, building, count):
-        for n in self.items:
-            if n.building.is_roughly(building):
-                n.update_count(count)
-                
-    def clear(self):
-        for item in self.items:
-            item.remove(self.layout)
-        
-        self.items.clear()
+            self.groups[row] = group
+            self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+
+class BuildingList(QtWidgets.QTableView):
+    """The buildings in a region, one row per type and size. Clicking - on a row sells some"""
+    building_count_decrease = Qt.pyqtSignal(BuildingGroup)
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.building_model = BuildingModel(self)
+        self.setModel(self.building_model)
+        self.verticalHeader().hide()
+        self.setSelectionMode(QtWidgets.QAbstractItemView.NoSelection)
+        self.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.setShowGrid(False)
+        header = self.horizontalHeader()
+        header.setSectionResizeMode(QtWidgets.QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+
+        self.clicked.connect(self._clicked)
+
+    def _clicked(self, index):
+        if index.column() == BuildingModel.SELL_COLUMN:
+            self.building_count_decrease.emit(self.building_model.groups[index.row()])
+
+    def set_groups(self, groups):
+        self.building_model.set_groups(groups)
+
+    def update_group(self, key, group):
+        self.building_model.update_group(key, group)
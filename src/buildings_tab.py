@@ -1,6 +1,6 @@
 from PyQt5 import QtWidgets, Qt
 from data import *
-from building_list import BuildingList, BuildingEntry
+from building_list import BuildingList, BuildingGroup
 from constants import BUILDING_INFO
 from building import Building
 from transaction import Transaction, TransactionType
@@ -28,7 +28,6 @@ class BuildingsTab(QtWidgets.QWidget):
         for region in data.regions.keys():
             self.region_select.addItem(region)
 
-        self.buildings = []
         self.building_list = BuildingList(self)
         
         self.layout = QtWidgets.QGridLayout(self)
@@ -60,8 +59,6 @@ class BuildingsTab(QtWidgets.QWidget):
         self.l_proj_income = QtWidgets.QLabel(self)
         self.l_proj_employ = QtWidgets.QLabel(self)
         
-        self.spacer = QtWidgets.QLabel("", self)
-        
         self.layout.addWidget(self.region_select, 0, 0)
         self.layout.addWidget(self.e_newregion,   0, 1)
         self.layout.addWidget(self.b_newregion,   0, 2)
@@ -85,8 +82,7 @@ class BuildingsTab(QtWidgets.QWidget):
         self.layout.addWidget(self.l_proj_employ, 3, 2)
         
         self.layout.addWidget(self.building_list, 4, 0, 1, 7)
-        self.layout.addWidget(self.spacer,        5, 0, 1, 7)
-        self.layout.setRowStretch(5, 1)
+        self.layout.setRowStretch(4, 1)
         self.setLayout(self.layout)
         
         self.type_selector.activated[str].connect(lambda t: self.recalc_preview())
@@ -96,7 +92,7 @@ class BuildingsTab(QtWidgets.QWidget):
         self.b_newregion.clicked.connect(self._add_region)
         self.b_delregion.clicked.connect(self._del_region)
         self.region_select.activated[str].connect(lambda r: self._region_change())
-        self.building_list.building_count_decrease[BuildingEntry].connect(self._remove_building)
+        self.building_list.building_count_decrease[BuildingGroup].connect(self._remove_building)
         self._region_change()
         self.recalc_preview()
         
@@ -105,7 +101,7 @@ class BuildingsTab(QtWidgets.QWidget):
         if len(region.strip()) == 0:
             send_info_popup("Enter a region name first")
             return
-        if region in data["regions"]:
+        if region in self.data.regions:
             send_info_popup("Enter a unique region name")
             return
             
@@ -113,7 +109,7 @@ class BuildingsTab(QtWidgets.QWidget):
 
         self.region_select.addItem(region)
         self.data.add_region(region)
-        self.data.save()
+        self.data.mark_dirty()
     
     def _del_region(self):
         if not self._check_real_region():
@@ -126,36 +122,22 @@ class BuildingsTab(QtWidgets.QWidget):
             return
             
         self.data.remove_region(region)
-        self.data.save()
+        self.data.mark_dirty()
         self.region_select.removeItem(self.region_select.currentIndex())
 
     def _region_change(self):
         self.curr_region = self.region_select.currentText()
-
-        self.building_list.clear()
-        self.buildings = []
-        if self.curr_region == "Total":
-            for region in self.data.regions.values():
-                for building in region:
-                    self.buildings.append(building)
-        else:
-            self.buildings = self.data.regions[self.curr_region]
-        
-        building_nums = []
-        for building in self.buildings:
-            bid = (building.btype, building.size)
-            if not (building.btype, building.size) in [(b[0].btype, b[0].size) for b in building_nums]:
-                building_nums.append([building, 0])
-                idx = len(building_nums) - 1
-            else:
-                idx = [i for i, b in enumerate(building_nums) if b[0].is_roughly(building)][0]
-            building_nums[idx][1] += building.count
-        
-        for building, count in building_nums:
-            self.building_list.add_building(building, count)
-        
+        region = None if self.curr_region == "Total" else self.curr_region
+        groups = self.data.building_groups(region)
+        self.building_list.set_groups([BuildingGroup(b, count) for b, count in groups.values()])
         self.recalc_preview()
         self.region_changed.emit(self.curr_region)
+
+    def _update_group(self, btype, size):
+        """Update the row for one type and size after buying or selling some"""
+        group = self.data.regions[self.curr_region].group(btype, size)
+        self.building_list.update_group((btype, size), None if group is None else BuildingGroup(*group))
+        self.region_changed.emit(self.curr_region)
         
     def recalc_preview(self):
         btype = self.type_selector.currentData()
@@ -188,13 +170,11 @@ class BuildingsTab(QtWidgets.QWidget):
         self.l_proj_bal.show()
         self.l_proj_income.show()
         self.l_proj_employ.show()
-        self.data.regions[self.curr_region].append(building)
+        bal, income, employment = self.data.aggregates.project([building], calc_bal(self.data))
                 
-        self.l_proj_bal.setText("Projected bal: " + format_money(calc_bal(self.data) - building.cost(l=Building.get_lorentz(self.data.eco_cache))))
-        self.l_proj_income.setText("Projected income: " + format_money(calc_income(self.data)[0]))
-        self.l_proj_employ.setText("Projected employment: " + str(round(calc_employment(self.data) * 100, 1)) + "%")
-        
-        self.data.regions[self.curr_region].pop()
+        self.l_proj_bal.setText("Projected bal: " + format_money(bal))
+        self.l_proj_income.setText("Projected income: " + format_money(income))
+        self.l_proj_employ.setText("Projected employment: " + str(round(employment * 100, 1)) + "%")
     
     def _check_real_region(self):
         """check the current region is not 'Total'. If it is, warn the user
@@ -215,14 +195,9 @@ class BuildingsTab(QtWidgets.QWidget):
         else:
             building = Building(btype, self.data.current_day, Building.get_lorentz(self.data.eco_cache), count=count)
 
-        if not (building.btype, building.size) in [(b.btype, b.size) for b in self.buildings]:
-            self.building_list.add_building(building, 0)
-        
-        self.buildings.append(building)
-
-        self.building_list.update_building(building, sum([b.count for b in self.buildings if b.is_roughly(building)]))
-        self.data.regions[self.curr_region] = self.buildings
-        self.data.save()
+        self.data.add_building(self.curr_region, building)
+        self._update_group(building.btype, building.size)
+        self.data.mark_dirty()
         
         self.parent.transactions_tab.add_transaction(Transaction(
             TransactionType.BUY,
@@ -230,44 +205,22 @@ class BuildingsTab(QtWidgets.QWidget):
             buildings=[building],
         ))
         
-    def _remove_building(self, entry: BuildingEntry):
+    def _remove_building(self, group: BuildingGroup):
         if not self._check_real_region():
             return
 
-        count, ok = QtWidgets.QInputDialog.getInt(self, "Sell building", "How many " + entry.building.name() + "s do you want to sell?", 1, 1, entry.count)
+        count, ok = QtWidgets.QInputDialog.getInt(self, "Sell building", "How many " + group.building.name() + "s do you want to sell?", 1, 1, group.count)
         if not ok:
             return
 
-        correct_types = [b for b in self.buildings if b.btype == entry.building.btype and b.size == entry.building.size]
-        correct_types = sorted(correct_types, key=lambda b: -b.lorentz)
-        buildings = []
-        for b in correct_types[:count]:
-            self.buildings.remove(b)
-            buildings.append(b)
-        
-        if entry.count <= count:
-            self.building_list.remove_building(buildings[0])
-        else:
-            self.building_list.update_building(buildings[0], len([1 for b in self.buildings if b.is_roughly(buildings[0])]))
-
-        last_t = data["transactions"][-1]
-        if False and last_t.trans_type == TransactionType.BUY and last_t.building == building and last_t.count >= count:
-            # update/cancel out last transaction instead
-            if last_t.count == count:
-                # get rid entirely
-                data["transactions"].pop(-1)
-                self.parent.transactions_tab.table.removeRow(len(data["transactions"]))
-            else:
-                last_t.count -= count
-                self.parent.transactions_tab.set_row_to(len(data["transactions"]) - 1, last_t)
+        buildings = self.data.sell_buildings(self.curr_region, group.building.btype, group.building.size, count)
+        self._update_group(group.building.btype, group.building.size)
 
-        else:
-            self.parent.transactions_tab.add_transaction(Transaction(
-                TransactionType.SELL,
-                data["current_day"].isoformat(),
-                buildings=buildings,
-            ))
+        self.parent.transactions_tab.add_transaction(Transaction(
+            TransactionType.SELL,
+            self.data.current_day.isoformat(),
+            buildings=buildings,
+        ))
         
-        data["regions"][self.curr_region]["buildings"] = self.buildings
-        save()
+        self.data.mark_dirty()
         self.recalc_preview()
\ No newline at end of file
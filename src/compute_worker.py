@@ -0,0 +1,59 @@
+import sys
+import threading
+from PyQt5 import QtCore, Qt
+
+class ComputeWorker(QtCore.QThread):
+    """
+    QThread that runs the slow jobs (writing saves and backups, loading the
+    history for graphs) one at a time, in the order they were submitted, so
+    the GUI thread never has to wait for them.
+
+    A job submitted with the same key as one that's still waiting replaces
+    it but keeps its place in the queue, so a burst of the same job only gets
+    run once. Jobs with no key are always run. Results come back through
+    `job_done`, on the GUI thread, and get passed to the job's callback.
+
+    Jobs run on another thread, so they mustn't look at `Data` itself. Give
+    them a copy of whatever they need (see `Data.queue_save`).
+    """
+    job_done = Qt.pyqtSignal(object, object) # callback, result
+    job_failed = Qt.pyqtSignal(object) # sys.exc_info() of the job that raised
+
+    def __init__(self):
+        super().__init__()
+        self.jobs = {} # key -> (fn, args, callback), dicts keep the order things went in
+        self.cond = threading.Condition()
+        self.running = True
+        self.job_done.connect(self._job_done)
+
+    def submit(self, key, fn, *args, callback=None):
+        """Run `fn(*args)` on the worker, then `callback(result)` back on the GUI thread"""
+        with self.cond:
+            self.jobs[object() if key is None else key] = (fn, args, callback)
+            self.cond.notify()
+
+    def stop(self):
+        """Finish off whatever's queued, then stop. `wait()` for it afterwards"""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.jobs:
+                    self.cond.wait()
+                if not self.jobs:
+                    return
+                fn, args, callback = self.jobs.pop(next(iter(self.jobs)))
+
+            try:
+                result = fn(*args)
+            except Exception:
+                self.job_failed.emit(sys.exc_info())
+                continue
+            if callback is not None:
+                self.job_done.emit(callback, result)
+
+    def _job_done(self, callback, result):
+        callback(result)
@@ -1,4 +1,5 @@
 from building_info import BuildingInfo
+import datetime
 from enum import IntEnum, unique
 # IDs
 @unique
@@ -58,4 +59,7 @@ BUILDING_INFO = {
     BType.HOUSE                 : BuildingInfo(0,     0,     69420,    "House"),
     BType.OFFICE                : BuildingInfo(18,    1,     1872.00,  "Office"),
     BType.METRO_STATION         : BuildingInfo(12.9,  1,     1341.60,  "Metro Station")
-}
\ No newline at end of file
+}
+
+# airports bought before this employ 6 people no matter the size, see `Building.employees`
+AIRPORT_CUTOFF = datetime.date(2022, 10, 20)
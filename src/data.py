@@ -1,29 +1,19 @@
 from constants import BType, MONEY_PREFIX
+from kernel import economy_totals
 import datetime
 
 def calc_population(data):
-    regions = {}
-    total_people = 0
-    for region in data.regions:
-        people = 0
-        for building in data.regions[region]:
-            if building.btype == BType.HOUSE:
-                people += building.size        
-        regions[region] = people
-        total_people += people
-    
-    return total_people, regions
+    totals = economy_totals(data.regions)
+    regions = {region: t[0] for region, t in totals.items()}
+    return sum(regions.values()), regions
 
 def calc_jobs(data):
+    totals = economy_totals(data.regions)
     regions = {}
     total_jobs = 0
-    for region in data.regions:
-        jobs = 0
-        for building in data.regions[region]:
-            if building.btype != BType.HOUSE:
-                jobs += building.employees()
-        regions[region] = jobs
-        total_jobs += jobs
+    for region, t in totals.items():
+        regions[region] = t[1]
+        total_jobs += t[1]
 
     return total_jobs, regions
         
@@ -34,36 +24,33 @@ def calc_employment(data):
     return jobs / pop if pop != 0 else 0
 
 def calc_income(data):
-    employment = calc_employment(data)
+    totals = economy_totals(data.regions)
+    pop = sum(t[0] for t in totals.values())
+    jobs = 0
+    for t in totals.values():
+        jobs += t[1]
+    employment = jobs / pop if pop != 0 else 0
+
     gross_income = 0
     regional_income = {}
     reduce_by = lambda i, p: i / p if p >= 1 else i * p
-    for region in data.regions:
-        region_gross_income = 0
-        for building in data.regions[region]:
-            region_gross_income += building.income()
-
-        region_income = reduce_by(region_gross_income, employment)
-        regional_income[region] = region_income
-        gross_income += region_gross_income
+    for region, t in totals.items():
+        regional_income[region] = reduce_by(t[2], employment)
+        gross_income += t[2]
     
     income = reduce_by(gross_income, employment)
     return income, regional_income
 
 def calc_bal(data):
-    bal = 0
-    for t in data.transactions:
-        bal += t.compute_amount()
-    
-    return bal
+    return data.transactions.balance()
 
 def calc_industry_income(data):
     industries = {}
     employ = calc_employment(data)
     reduce_by = lambda i, p: i / p if p >= 1 else i * p
-    for region in data["regions"]:
-        for building in data["regions"][region]["buildings"]:
-            if building.btype != HOUSE:
+    for region in data.regions:
+        for building in data.regions[region]:
+            if building.btype != BType.HOUSE:
                 if not building.name(airports_together=True) in industries:
                     industries[building.name(airports_together=True)] = 0
                 industries[building.name(airports_together=True)] += reduce_by(building.income(), employ)
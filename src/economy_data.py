@@ -0,0 +1,476 @@
+import json
+import os
+import sys
+import datetime
+import random
+import threading
+from building import intern_building
+from transaction import Transaction, TransactionType
+from region_store import RegionStore
+from aggregates import Aggregates
+from ledger import Ledger
+from packet_schedule import PacketSchedule
+from snapshot_writer import write_snapshot
+
+# really bad idea tbh
+# try to guess the location of economy.json
+# by looking at our cwd. if we're still in src
+# then it's in ..
+# else, assume it's in .
+if os.path.basename(os.getcwd()) == "src":
+    BACKUP_DIR = os.path.join("..", "backups")
+    ECONOMY_FILE = os.path.join("..", "economy.json")
+else:
+    BACKUP_DIR = "backups"
+    ECONOMY_FILE = "economy.json"
+BACKUP_STORE = os.path.join(BACKUP_DIR, "history.jsonl")
+METRICS_FILE = os.path.join(BACKUP_DIR, "metrics.jsonl")
+
+# if set, saving appends what changed to a journal next to the economy file
+# instead of rewriting the whole thing. The journal gets folded back into
+# the economy file once it has more than COMPACT_AFTER records in it
+JOURNAL_SAVES = True
+COMPACT_AFTER = 500
+
+# layout of economy.json that `serialise` writes. Version 2 has every different
+# (btype, size, lorentz) listed once in "building_kinds", and buildings everywhere
+# else in the file are [index into that, count]. Files with no "format" are version 1
+FORMAT_VERSION = 2
+
+def journal_path(fname):
+    return os.path.splitext(fname)[0] + ".journal"
+
+def append_journal(path, records):
+    """Append `records` to the journal at `path`, a line of json each. If that fails part
+    way through, what did get written is cut off again, so half a record isn't left in
+    front of whatever's appended next"""
+    data = memoryview("".join(json.dumps(record) + "\n" for record in records).encode("utf-8"))
+    with open(path, "ab", buffering=0) as f:
+        start = f.tell()
+        try:
+            while data:
+                data = data[f.write(data):]
+        except OSError:
+            try:
+                f.truncate(start)
+            except OSError:
+                pass # read_journal will cut it off anyway, as long as nothing's after it
+            raise
+
+class Data:
+    """
+    Represents the economy.json file in an easier to work with way.
+    Also handles the serialisation/deserialisation of all objects.
+    This involves decoding the json and then constructing various
+    `Building`, `Transaction` and `Loan` objects from the resulting dict
+    """
+    def __init__(self):
+        self.regions = {}
+        self.transactions = Ledger()
+        self.current_day = None
+        self.loans = []
+        self.given_loans = []
+        self.eco_cache = 0
+        self.future_packets = PacketSchedule()
+        self.whoami = None
+        self.outbox = [] # packets for the server that haven't been sent yet
+        self.last_packet_id = 0 # id of the newest packet from the server that's been dealt with
+        self.packet_store = None # uid of the server's packet store that id is from
+        self.aggregates = Aggregates()
+
+        self.journal = [] # changes made since the last save, see `save_journal`
+        self.journal_seq = 0 # sequence number of the last journal record written or replayed
+        self.journal_len = 0 # number of records in the journal file
+        self.saved_state = None
+        self.unwritten = [] # (kind, fname, content) queued by `queue_save` for `write_queued`
+        self.queue_lock = threading.Lock() # guards `unwritten` and `generation`
+        self.generation = 0 # number of snapshots queued so far, so one being written can tell it's out of date
+        self.write_lock = threading.Lock() # held while writing, so writes never overlap or go out of order
+        # if set, `save` hands `write_queued` to this to be run on another thread rather than writing there and then
+        self.background = None
+        self.dirty = False # changed since the last save
+        # if set, `mark_dirty` calls this to have a save done soon, rather than saving there and then
+        self.schedule_save = None
+
+    def __getstate__(self):
+        # backups are loaded in other processes, and locks don't pickle
+        state = dict(self.__dict__)
+        del state["queue_lock"], state["write_lock"]
+        state["background"] = None
+        state["schedule_save"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.queue_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    def set_defaults(self):
+        self.transactions.append(Transaction(TransactionType.MANUAL, datetime.date(2022, 10, 10).isoformat(), amount=40000, comment="Initial balance"))
+        self.current_day = datetime.date(2022, 10, 10)
+
+    def read_from_file(self, fname):
+        with open(fname, "r") as f:
+            raw_data = json.loads(f.read())
+
+        # anything in the journal newer than the snapshot gets replayed on top of it.
+        # loans, the date etc. are small so they're journaled as a whole; just take the latest
+        self.journal_seq = raw_data.get("journal_seq", 0)
+        journal = self.read_journal(journal_path(fname))
+        for record in journal:
+            if record["op"] == "state":
+                raw_data.update({k: v for k, v in record.items() if not k in ("op", "seq")})
+
+        self.deserialise(raw_data)
+        for record in journal:
+            self.replay(record)
+        self.journal = []
+        self.saved_state = self.serialise_state()
+        self.eco_cache = self.aggregates.income()
+
+    def deserialise(self, raw_data):
+        """Load everything from the dict stored in economy.json"""
+        self.current_day = datetime.date.fromisoformat(raw_data["current_day"])
+        kinds = raw_data.get("building_kinds") # None before version 2
+        
+        for reg in raw_data["regions"]:
+            self.regions[reg] = RegionStore()
+            for b in raw_data["regions"][reg]["buildings"]:
+                self.regions[reg].add(self.deserialise_building(b, kinds=kinds))
+        self.aggregates.rebuild(self.regions)
+        
+        self.transactions = Ledger(self.deserialise_transaction(t, kinds=kinds) for t in raw_data["transactions"])
+        self.loans = [self.deserialise_loan(l) for l in raw_data.get("loans", [])]
+        self.given_loans = [self.deserialise_loan(l) for l in raw_data.get("given_loans", [])]
+        self.future_packets = PacketSchedule(raw_data.get("future_packets", []))
+        self.outbox = raw_data.get("outbox", [])
+        self.last_packet_id = raw_data.get("last_packet_id", 0)
+        self.packet_store = raw_data.get("packet_store")
+        self.eco_cache = self.aggregates.income()
+        # whoami isn't saved yet, so this is normally None and main asks for it
+        self.whoami = raw_data.get("whoami")
+
+    def write_to_file(self, fname):
+        write_snapshot(fname, self.serialise())
+
+    def serialise(self):
+        """Turn everything into the dict stored in economy.json"""
+        kinds = BuildingKinds()
+        raw_data = {"format": FORMAT_VERSION,
+                    "current_day": self.current_day.isoformat(),
+                    "regions": {r: {"buildings": kinds.encode(self.serialise_buildings(self.regions[r]))} for r in self.regions},
+                    "loans": [self.serialise_loan(l) for l in self.loans],
+                    "given_loans": [self.serialise_loan(l) for l in self.given_loans],
+                    "future_packets": list(self.future_packets),
+                    "outbox": list(self.outbox),
+                    "last_packet_id": self.last_packet_id,
+                    "packet_store": self.packet_store,
+                    "journal_seq": self.journal_seq,
+                    "transactions": [kinds.encode_transaction(self.serialise_transaction(t)) for t in self.transactions]}
+        raw_data["building_kinds"] = kinds.kinds
+        # TODO in final version save whoami
+        return raw_data
+
+    def serialise_building(self, b):
+        # either [type, size, lorentz] if only one
+        # or [type, size, lorentz, count] if run length encoded
+        if b.count == 1:
+            return [b.btype, b.size, b.lorentz]
+        else:
+            return [b.btype, b.size, b.lorentz, b.count]
+            
+    def serialise_buildings(self, buildings):
+        """`serialise_building` of each of `buildings`, with ones that only differ by count put together"""
+        counts = {}
+        for b in buildings:
+            counts[(b.btype, b.size, b.lorentz)] = counts.get((b.btype, b.size, b.lorentz), 0) + b.count
+        return [[*k, c] if c != 1 else list(k) for k, c in counts.items()]
+
+    def deserialise_building(self, obj, lorentz: float=None, kinds=None):
+        if kinds is not None: # version 2, [kind, count]
+            btype, size, lorentz = kinds[obj[0]]
+            return intern_building(btype, self.current_day, lorentz, size, count=obj[1])
+        if lorentz is None:
+            lorentz = 1
+        # old serialised buildings are either a list of [type, size]
+        # or just a single int type. New serialised buildings are always
+        # a list of [type, size, lorentz] to avoid ambiguity.
+        # this is actually a lie now, *new* new buildings are either a 
+        # [type, size, lorentz] or a [type, size, lorentz, count]
+        # for run length encoding
+        if type(obj) == list:
+            if len(obj) == 2: # old building, type and size
+                return intern_building(obj[0], self.current_day, lorentz, obj[1])
+            elif len(obj) == 3: # new building, type size and lorentz
+                return intern_building(obj[0], self.current_day, obj[2], obj[1])
+            elif len(obj) == 4: # new new buildig, (type, size, lorentz, count)
+                return intern_building(obj[0], self.current_day, obj[2], obj[1], count=obj[3])
+        else: # old building, just type
+            return intern_building(obj, self.current_day, lorentz)
+
+    def serialise_transaction(self, trans):
+        if trans.trans_type in (TransactionType.MANUAL, TransactionType.TAKEN_LOAN, TransactionType.GIVEN_LOAN):
+            return {"amount": trans.amount,
+                    "comment": trans.comment,
+                    "type": trans.trans_type,
+                    "timestamp": trans.timestamp}
+        else:
+            return {"buildings": self.serialise_buildings(trans.buildings),
+                    "type": trans.trans_type,
+                    "timestamp": trans.timestamp}
+
+    def deserialise_transaction(self, object, kinds=None):
+        # lots of transactions (and every backup) share the same few dates
+        timestamp = sys.intern(object["timestamp"])
+        if object["type"] in (TransactionType.MANUAL, TransactionType.TAKEN_LOAN, TransactionType.GIVEN_LOAN):
+            return Transaction(object["type"], timestamp, amount=object["amount"], comment=object["comment"])
+        else:
+            if object.get("buildings") == None: # old transaction, assume one building + count (+ lorentz)
+                buildings = [self.deserialise_building(object["building"], lorentz=object.get("lorentz"))] * object["count"]
+            else: # new transaction, deserialise list of buildings with one lorentz each
+                buildings = [self.deserialise_building(i, kinds=kinds) for i in object["buildings"]]
+            return Transaction(object["type"], timestamp, buildings=self.combine_buildings(buildings))
+
+    def combine_buildings(self, buildings):
+        """`buildings` with the ones that only differ by count made into one building, so a
+        transaction holds one (shared, see `intern_building`) building per kind it bought or sold"""
+        counts = {}
+        for b in buildings:
+            counts[(b.btype, b.size, b.lorentz)] = counts.get((b.btype, b.size, b.lorentz), 0) + b.count
+        return [intern_building(btype, self.current_day, lorentz, size, count=count) for (btype, size, lorentz), count in counts.items()]
+
+    def serialise_loan(self, loan):
+        return [loan.amount, loan.interest_rate, loan.country_name, loan.amount_paid, loan.uid]
+
+    def deserialise_loan(self, obj):
+        # very old loans don't have amount_paid, and old ones don't have a uid
+        return Loan(obj[0], obj[1], obj[2], obj[3] if len(obj) > 3 else 0, obj[4] if len(obj) > 4 else None)
+    
+    def serialise_state(self):
+        return {"current_day": self.current_day.isoformat(),
+                "loans": [self.serialise_loan(l) for l in self.loans],
+                "given_loans": [self.serialise_loan(l) for l in self.given_loans],
+                "future_packets": list(self.future_packets),
+                "outbox": list(self.outbox),
+                "last_packet_id": self.last_packet_id,
+                "packet_store": self.packet_store}
+
+    def read_journal(self, fname):
+        """Read the records from a journal file that aren't already in the snapshot"""
+        if not os.path.isfile(fname):
+            return []
+        records = []
+        good = 0 # offset just past the last whole record
+        with open(fname, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break # never finished writing
+                try:
+                    record = json.loads(line)
+                except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+                    break # half written record from a crash, nothing after it can be trusted
+                good += len(line)
+                self.journal_len += 1
+                if record["seq"] > self.journal_seq:
+                    records.append(record)
+                    self.journal_seq = record["seq"]
+
+        if good != os.path.getsize(fname):
+            # cut the half written record off, or everything appended after it
+            # next time would be stuck behind it and never read
+            with open(fname, "r+b") as f:
+                f.truncate(good)
+        return records
+
+    def replay(self, record):
+        op = record["op"]
+        if op == "add_region":
+            self.add_region(record["region"])
+        elif op == "remove_region":
+            self.remove_region(record["region"])
+        elif op == "add_building":
+            self.add_building(record["region"], self.deserialise_building(record["building"]))
+        elif op == "sell":
+            b = self.deserialise_building(record["building"])
+            self.sell_buildings(record["region"], b.btype, b.size, b.count, lorentz=b.lorentz)
+        elif op == "add_transaction":
+            self.add_transaction(self.deserialise_transaction(record["transaction"]))
+        elif op == "remove_transaction":
+            self.remove_transaction(record["idx"])
+
+    def mark_dirty(self):
+        """Something's changed that needs saving. With `schedule_save` set this only asks
+        for a save, so a run of changes all get saved together"""
+        self.dirty = True
+        if self.schedule_save is None:
+            self.save()
+        else:
+            self.schedule_save()
+
+    def save(self):
+        """Save, on another thread if `background` is set"""
+        self.queue_save()
+        if self.background is None:
+            self.write_queued()
+        else:
+            self.background(self.write_queued)
+
+    def flush(self):
+        """Save, and don't return until it's all on disk (including anything already queued)"""
+        self.queue_save()
+        self.write_queued()
+
+    def queue_save(self):
+        """Work out what a save needs to write, without writing it. This is the only part
+        that looks at the data, so `write_queued` can be run on any thread"""
+        self.dirty = False
+        if JOURNAL_SAVES:
+            self.save_journal(ECONOMY_FILE)
+        else:
+            self.queue_write("snapshot", ECONOMY_FILE, self.serialise())
+
+    def queue_write(self, kind, fname, content):
+        with self.queue_lock:
+            self.unwritten.append((kind, fname, content))
+            if kind == "snapshot":
+                self.generation += 1
+
+    def write_queued(self):
+        """Write everything queued so far, oldest first"""
+        with self.write_lock:
+            with self.queue_lock:
+                writes, self.unwritten = self.unwritten, []
+                generation = self.generation
+            # a snapshot has everything in it, so nothing queued before one needs writing
+            snapshots = [i for i, (kind, _, _) in enumerate(writes) if kind == "snapshot"]
+            if snapshots:
+                writes = writes[snapshots[-1]:]
+
+            for i, (kind, fname, content) in enumerate(writes):
+                try:
+                    if kind == "snapshot":
+                        if not write_snapshot(fname, content, stale=lambda: self.generation != generation):
+                            # a newer snapshot got queued while writing this one. It'll be
+                            # written next time, and has everything after this one in too
+                            return
+                        if JOURNAL_SAVES:
+                            open(journal_path(fname), "w").close()
+                    else:
+                        append_journal(journal_path(fname), content)
+                except OSError:
+                    # put back everything not written yet, this one included, in front of anything
+                    # queued since, so the next save tries them again in order. Writing one of
+                    # them twice is fine, as journal records already replayed get skipped
+                    with self.queue_lock:
+                        self.unwritten[:0] = writes[i:]
+                    raise
+
+    def save_journal(self, fname):
+        """Queue everything that changed since the last save to be appended to the journal,
+        or a rewrite of `fname` instead if the journal has got too long"""
+        state = self.serialise_state()
+        if state != self.saved_state:
+            self.journal.append({"op": "state", **state})
+            self.saved_state = state
+
+        if self.journal_len + len(self.journal) > COMPACT_AFTER or not os.path.isfile(fname):
+            self.compact(fname)
+            return
+
+        if not self.journal:
+            return
+        for record in self.journal:
+            self.journal_seq += 1
+            record["seq"] = self.journal_seq
+        self.queue_write("journal", fname, self.journal)
+        self.journal_len += len(self.journal)
+        self.journal = [] # not clear(), the queued write still has hold of it
+
+    def compact(self, fname):
+        """Queue a full snapshot to be written to `fname`, emptying its journal"""
+        self.journal = []
+        self.saved_state = self.serialise_state()
+        # the snapshot records journal_seq, so if we die before the journal
+        # is emptied the old records just get skipped next time
+        self.queue_write("snapshot", fname, self.serialise())
+        self.journal_len = 0
+
+    def add_region(self, reg_name):
+        self.regions[reg_name] = RegionStore()
+        self.aggregates.add_region(reg_name)
+        self.journal.append({"op": "add_region", "region": reg_name})
+
+    def remove_region(self, reg_name):
+        del self.regions[reg_name]
+        self.aggregates.remove_region(reg_name)
+        self.journal.append({"op": "remove_region", "region": reg_name})
+
+    def add_building(self, region, building):
+        self.regions[region].add(building)
+        self.aggregates.add_building(region, building)
+        self.journal.append({"op": "add_building", "region": region, "building": self.serialise_building(building)})
+
+    def building_groups(self, region=None):
+        """{(btype, size): (building, count)} for `region`, or all of them put together if it's None.
+        See `RegionStore.groups`"""
+        if region is not None:
+            return self.regions[region].groups()
+        groups = {}
+        for store in self.regions.values():
+            for key, (building, count) in store.groups().items():
+                if key in groups:
+                    groups[key] = (groups[key][0], groups[key][1] + count)
+                else:
+                    groups[key] = (building, count)
+        return groups
+
+    def sell_buildings(self, region, btype, size, count, lorentz=None):
+        """Remove `count` buildings of the given type and size from `region`, returning the ones removed"""
+        sold = self.regions[region].take(btype, size, count, lorentz=lorentz)
+        for building in sold:
+            self.aggregates.remove_building(region, building)
+            self.journal.append({"op": "sell", "region": region, "building": self.serialise_building(building)})
+        return sold
+
+    def add_transaction(self, transaction):
+        self.transactions.append(transaction)
+        self.journal.append({"op": "add_transaction", "transaction": self.serialise_transaction(transaction)})
+
+    def remove_transaction(self, idx):
+        self.transactions.pop(idx)
+        self.journal.append({"op": "remove_transaction", "idx": idx})
+
+
+class BuildingKinds:
+    """The "building_kinds" table of a version 2 file, built up as buildings are encoded"""
+    def __init__(self):
+        self.kinds = [] # [btype, size, lorentz]
+        self.index = {} # (btype, size, lorentz) -> position in kinds
+
+    def encode(self, buildings):
+        """[kind, count] for each of `buildings` (as given by `Data.serialise_buildings`)"""
+        encoded = []
+        for b in buildings:
+            key = (b[0], b[1], b[2])
+            kind = self.index.get(key)
+            if kind is None:
+                kind = self.index[key] = len(self.kinds)
+                self.kinds.append(list(key))
+            encoded.append([kind, b[3] if len(b) > 3 else 1])
+        return encoded
+
+    def encode_transaction(self, trans):
+        if "buildings" in trans:
+            trans["buildings"] = self.encode(trans["buildings"])
+        return trans
+
+class Loan:
+    def __init__(self, amount, interest_rate, country_name, amount_paid, uid=None):
+        self.amount = amount
+        self.interest_rate = interest_rate
+        self.country_name = country_name
+        self.amount_paid = amount_paid
+        if uid is None:
+            self.uid = random.randint(0, 2**31-1)
+        else:
+            self.uid = uid
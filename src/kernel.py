@@ -0,0 +1,33 @@
+import numpy as np
+from constants import BType, BUILDING_INFO, AIRPORT_CUTOFF
+
+# BUILDING_INFO as arrays indexed by BType
+WAGES = np.array([BUILDING_INFO[t].wage for t in BType], dtype=float)
+EMPLOYEES = np.array([BUILDING_INFO[t].employees for t in BType], dtype=float)
+
+def region_totals(store):
+    """(population, jobs, gross income) of a `RegionStore`, worked out on its columns"""
+    if len(store) == 0:
+        return 0, 0, 0
+    btypes = np.array(store.btypes, dtype=int)
+    sizes = np.array([s if s is not None else 0 for s in store.sizes], dtype=int)
+    counts = np.array(store.counts, dtype=int)
+    houses = btypes == BType.HOUSE
+
+    employees = EMPLOYEES[btypes] * counts
+    airports = btypes == BType.AIRPORT
+    if airports.any():
+        old = np.array([d < AIRPORT_CUTOFF for d in store.dates])
+        employees = np.where(airports & old, 6 * counts, employees)
+        employees = np.where(airports & ~old, sizes / 20 * counts, employees)
+
+    population = int(np.sum(sizes[houses] * counts[houses]))
+    # the same as adding the buildings up one at a time to within float rounding, not
+    # exactly: identical buildings are one row times their count, and sums go in a different order
+    jobs = float(np.sum(employees[~houses]))
+    gross_income = float(np.sum(WAGES[btypes] * employees * 8))
+    return population, jobs, gross_income
+
+def economy_totals(regions):
+    """Per region (population, jobs, gross income) for a dict of `RegionStore`s"""
+    return {name: region_totals(store) for name, store in regions.items()}
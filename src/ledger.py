@@ -0,0 +1,90 @@
+import bisect
+import datetime
+
+class Ledger:
+    """
+    List of transactions that also remembers each transaction's amount and
+    the running balance after it, so the balance doesn't have to be re-summed
+    every time it's shown. Behaves enough like a list that it can be used
+    as `Data.transactions` directly.
+    """
+    def __init__(self, transactions=None):
+        self.transactions = []
+        self.amounts = []
+        self.timestamps = []
+        self.prefix = [] # prefix[i] is the balance after transactions[i]
+        self.valid = 0 # prefix sums from this index onwards need recomputing
+        self.in_order = True # whether timestamps are sorted, so they can be bisected directly
+        self.dated = None # (timestamps, balances) sorted by date, if they aren't in order
+        if transactions is not None:
+            for t in transactions:
+                self.append(t)
+
+    def append(self, transaction):
+        if self.timestamps and transaction.timestamp < self.timestamps[-1]:
+            self.in_order = False
+        self.transactions.append(transaction)
+        self.amounts.append(transaction.compute_amount())
+        self.timestamps.append(transaction.timestamp)
+        self.dated = None
+        if self.valid == len(self.prefix) == len(self.amounts) - 1:
+            self.prefix.append((self.prefix[-1] if self.prefix else 0) + self.amounts[-1])
+            self.valid += 1
+
+    def pop(self, idx=-1):
+        if idx < 0:
+            idx += len(self.transactions)
+        transaction = self.transactions.pop(idx)
+        self.amounts.pop(idx)
+        self.timestamps.pop(idx)
+        # everything after the removed transaction has the wrong running balance now
+        del self.prefix[idx:]
+        self.valid = min(self.valid, idx)
+        self.in_order = all(self.timestamps[i] <= self.timestamps[i + 1] for i in range(len(self.timestamps) - 1))
+        self.dated = None
+        return transaction
+
+    def _update(self):
+        bal = self.prefix[self.valid - 1] if self.valid > 0 else 0
+        for i in range(self.valid, len(self.amounts)):
+            bal += self.amounts[i]
+            self.prefix.append(bal)
+        self.valid = len(self.amounts)
+
+    def amount(self, idx):
+        return self.amounts[idx]
+
+    def balance(self):
+        """Current balance, O(1) unless a transaction was deleted since last time"""
+        self._update()
+        return self.prefix[-1] if self.prefix else 0
+
+    def balance_on(self, date):
+        """Balance at the end of `date` (a `datetime.date` or iso string)"""
+        if isinstance(date, datetime.date):
+            date = date.isoformat()
+        self._update()
+        if self.in_order:
+            timestamps, balances = self.timestamps, self.prefix
+        else:
+            if self.dated is None:
+                order = sorted(range(len(self.timestamps)), key=lambda i: self.timestamps[i])
+                balances = []
+                bal = 0
+                for i in order:
+                    bal += self.amounts[i]
+                    balances.append(bal)
+                self.dated = ([self.timestamps[i] for i in order], balances)
+            timestamps, balances = self.dated
+
+        i = bisect.bisect_right(timestamps, date)
+        return balances[i - 1] if i > 0 else 0
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __iter__(self):
+        return iter(self.transactions)
+
+    def __getitem__(self, idx):
+        return self.transactions[idx]
@@ -17,6 +17,9 @@ import re
 import requests
 import random
 import socket
+import select
+import queue
+import time
 sys.path.append("src")
 from typing import Union
 from building import *
@@ -24,181 +27,85 @@ from constants import *
 from data import *
 from transaction import Transaction, TransactionType
 from buildings_tab import BuildingsTab
+from economy_data import Data, Loan, BACKUP_DIR, ECONOMY_FILE, BACKUP_STORE, METRICS_FILE
+from backup_store import BackupStore
+from backup_loader import BackupLoader
+from metrics import MetricsIndex, day_metrics
+from compute_worker import ComputeWorker
+from wire import FRAMING, FrameReader, LineReader, encode_frame, encode_line
 
 MY_VERSION = "1.3.5"
 
-# really bad idea tbh
-# try to guess the location of economy.json
-# by looking at our cwd. if we're still in src
-# then it's in ..
-# else, assume it's in .
-if os.path.basename(os.getcwd()) == "src":
-    BACKUP_DIR = os.path.join("..", "backups")
-    ECONOMY_FILE = os.path.join("..", "economy.json")
-else:
-    BACKUP_DIR = "backups"
-    ECONOMY_FILE = "economy.json"
-
-class Data:
-    """
-    Represents the economy.json file in an easier to work with way.
-    Also handles the serialisation/deserialisation of all objects.
-    This involves decoding the json and then constructing various
-    `Building`, `Transaction` and `Loan` objects from the resulting dict
-    """
-    def __init__(self):
-        self.regions = {}
-        self.transactions = []
-        self.current_day = None
-        self.loans = []
-        self.given_loans = []
-        self.eco_cache = 0
-        self.future_packets = []
-        self.whoami = None
-
-    def set_defaults(self):
-        self.transactions.append(Transaction(TransactionType.MANUAL, datetime.date(2022, 10, 10).isoformat(), amount=40000, comment="Initial balance"))
-        self.current_day = datetime.date(2022, 10, 10)
-
-    def read_from_file(self, fname):
-        with open(fname, "r") as f:
-            raw_data = json.loads(f.read())
-
-        self.current_day = datetime.date.fromisoformat(raw_data["current_day"])
-        
-        for reg in raw_data["regions"]:
-            self.regions[reg] = []
-            for b in raw_data["regions"][reg]["buildings"]:
-                self.regions[reg].append(self.deserialise_building(b))
-        
-        self.transactions = [self.deserialise_transaction(t) for t in raw_data["transactions"]]
-        self.loans = [self.deserialise_loan(l) for l in raw_data.get("loans", [])]
-        self.given_loans = [self.deserialise_loan(l) for l in raw_data.get("given_loans", [])]
-        self.future_packets = raw_data.get("future_packets", [])
-        self.eco_cache = calc_income(self)[0]
-        if raw_data.get("whoami"):
-            self.whoami = raw_data["whoami"]
-        else:
-            self.whoami, entered = QtWidgets.QInputDialog.getText(None, "Select country", "Enter which country you are (for network communication)")
-            if not entered:
-                sys.exit(0)
-
-    def write_to_file(self, fname):
-        raw_data = {"current_day": self.current_day.isoformat(),
-                    "regions": {r: {"buildings": [self.serialise_building(b) for b in self.regions[r]]} for r in self.regions},
-                    "loans": [self.serialise_loan(l) for l in self.loans],
-                    "given_loans": [self.serialise_loan(l) for l in self.given_loans],
-                    "future_packets": self.future_packets,
-                    "transactions": [self.serialise_transaction(t) for t in self.transactions]}
-        # TODO in final version save whoami
-        
-        with open(fname, "w") as f:
-            f.write(json.dumps(raw_data))
-
-    def serialise_building(self, b):
-        # either [type, size, lorentz] if only one
-        # or [type, size, lorentz, count] if run length encoded
-        if b.count == 1:
-            return [b.btype, b.size, b.lorentz]
-        else:
-            return [b.btype, b.size, b.lorentz, b.count]
-            
-    def deserialise_building(self, obj, lorentz: float=None):
-        if lorentz is None:
-            lorentz = 1
-        # old serialised buildings are either a list of [type, size]
-        # or just a single int type. New serialised buildings are always
-        # a list of [type, size, lorentz] to avoid ambiguity.
-        # this is actually a lie now, *new* new buildings are either a 
-        # [type, size, lorentz] or a [type, size, lorentz, count]
-        # for run length encoding
-        if type(obj) == list:
-            if len(obj) == 2: # old building, type and size
-                return Building(obj[0], self.current_day, lorentz, obj[1])
-            elif len(obj) == 3: # new building, type size and lorentz
-                return Building(obj[0], self.current_day, obj[2], obj[1])
-            elif len(obj) == 4: # new new buildig, (type, size, lorentz, count)
-                return Building(obj[0], self.current_day, obj[2]. obj[1], count=obj[3])
-        else: # old building, just type
-            return Building(obj, self.current_day, lorentz)
-
-    def serialise_transaction(self, trans):
-        if trans.trans_type in (TransactionType.MANUAL, TransactionType.TAKEN_LOAN, TransactionType.GIVEN_LOAN):
-            return {"amount": trans.amount,
-                    "comment": trans.comment,
-                    "type": trans.trans_type,
-                    "timestamp": trans.timestamp}
-        else:
-            return {"buildings": [self.serialise_building(b) for b in trans.buildings],
-                    "type": trans.trans_type,
-                    "timestamp": trans.timestamp}
-
-    def deserialise_transaction(self, object):
-        if object["type"] in (TransactionType.MANUAL, TransactionType.TAKEN_LOAN, TransactionType.GIVEN_LOAN):
-            return Transaction(object["type"], object["timestamp"], amount=object["amount"], comment=object["comment"])
-        else:
-            if object.get("buildings") == None: # old transaction, assume one building + count (+ lorentz)
-                buildings = [self.deserialise_building(object["building"], lorentz=object.get("lorentz"))] * object["count"]
-                return Transaction(object["type"], object["timestamp"], buildings=buildings)
-            else: # new transaction, deserialise list of buildings with one lorentz each
-                return Transaction(object["type"], object["timestamp"], buildings=[self.deserialise_building(i) for i in object["buildings"]])
-
-    def serialise_loan(self, loan):
-        return [loan.amount, loan.interest_rate, loan.country_name, loan.amount_paid, loan.uid]
-
-    def deserialise_loan(self, obj):
-        return Loan(obj[0], obj[1], obj[2], obj[3], obj[4] if len(obj) > 4 else None)
-    
-    def save(self):
-        self.write_to_file(ECONOMY_FILE)
-
-    def add_region(self, reg_name):
-        self.regions[reg_name] = []
-
-    def remove_region(self, reg_name):
-        del self.regions[reg_name]
-
-
-class Loan:
-    def __init__(self, amount, interest_rate, country_name, amount_paid, uid=None):
-        self.amount = amount
-        self.interest_rate = interest_rate
-        self.country_name = country_name
-        self.amount_paid = amount_paid
-        if uid is None:
-            self.uid = random.randint(0, 2**31-1)
-        else:
-            self.uid = uid
+SERVER_ADDRESS = ("127.0.0.1", 7896)
+# seconds between tries at reconnecting to the server
+RECONNECT_DELAY = 5
+# seconds between asking the server for anything waiting for us. It sends packets
+# as they come in anyway, so this is just in case
+SYNC_INTERVAL = 60
+# most packets to list in the popup when a load come in at once
+MAX_POPUP_LINES = 15
+# seconds after something changes before it gets saved. Anything else that changes
+# in the meantime goes in the same save
+SAVE_DELAY = 0.5
+
+# keeps hold of backups once they've been loaded, so they only get loaded once
+BACKUP_LOADER = BackupLoader()
+
+def legacy_backups():
+    """Old style backups, which are a full copy of economy.json per day"""
+    return sorted(f for f in os.listdir(BACKUP_DIR) if f.endswith(".json"))
 
 def update_backup_formats():
     """Load and save every backup and the economy file,
-       which should save every file in the latest format"""
+       which should save every file in the latest format.
+       Old style backups are moved into the backup store where possible"""
 
     if not os.path.isdir(BACKUP_DIR):
         return
     
-    for fname in os.listdir(BACKUP_DIR):
-        newdata = Data()
-        newdata.read_from_file(os.path.join(BACKUP_DIR, fname))
-        newdata.write_to_file(os.path.join(BACKUP_DIR, fname))
+    store = BackupStore(BACKUP_STORE)
+    days = store.days()
+    fnames = [os.path.join(BACKUP_DIR, f) for f in legacy_backups()]
+    for fname, newdata in zip(fnames, BACKUP_LOADER.load_files(fnames)):
+        if days and newdata.current_day.isoformat() <= days[-1]:
+            # the store can only be added to at the end, so leave this one as it is
+            newdata.write_to_file(fname)
+            continue
+
+        store.append(newdata)
+        days.append(newdata.current_day.isoformat())
+        if store.matches(newdata):
+            os.remove(fname)
 
     newdata = Data()
     newdata.read_from_file(ECONOMY_FILE)
     newdata.write_to_file(ECONOMY_FILE)
 
-def get_historical_datas(data):
-    """Return a list of backups, plus the current data"""
+def get_historical_datas():
+    """Return a list of backups, oldest first"""
     if not os.path.isdir(BACKUP_DIR):
         return []
     
-    datas = []
-    for fname in os.listdir(BACKUP_DIR):
-        newdata = Data()
-        newdata.read_from_file(os.path.join(BACKUP_DIR, fname))
-        datas.append(newdata)
-    
-    datas.append(data)
-    return datas
+    datas = BACKUP_LOADER.load_files([os.path.join(BACKUP_DIR, f) for f in legacy_backups()])
+    datas += BACKUP_LOADER.load_store(BackupStore(BACKUP_STORE))
+    # old style backups that couldn't go in the store can be from any day
+    return sorted(datas, key=lambda d: d.current_day)
+
+def get_historical_metrics(today):
+    """Return the metrics of every backed up day, plus `today` (the `day_metrics` of the
+    current data), oldest first. Never looks at the current data, so it can be run on the
+    compute worker"""
+    index = MetricsIndex(METRICS_FILE)
+    days = index.days()
+    if os.path.isdir(BACKUP_DIR):
+        backed_up = set(f[:-len(".json")] for f in legacy_backups()) | set(BackupStore(BACKUP_STORE).days())
+        if not backed_up <= days.keys():
+            # there are backups from before the index existed, so work it out from them (just the once)
+            index.rebuild(get_historical_datas())
+            days = index.days()
+
+    metrics = [days[d] for d in sorted(days) if d != today["day"]]
+    return metrics + [today]
 
 def send_info_popup(txt):
     """Show an info messagebox"""
@@ -208,14 +115,65 @@ def send_info_popup(txt):
     msg.setStandardButtons(QtWidgets.QMessageBox.Ok)
     msg.exec_()
 
-class KeybindTable(QtWidgets.QTableWidget):
-    """Wrapper around a QTableWidget to expose key press events.
+class KeybindTable(QtWidgets.QTableView):
+    """Wrapper around a QTableView to expose key press events.
     Needed for detecting the delete key to delete a transaction"""
     keyPressed = Qt.pyqtSignal(QtGui.QKeyEvent)
     def keyPressEvent(self, event):    
         if type(event) == QtGui.QKeyEvent:
             self.keyPressed.emit(event)
 
+class TransactionModel(QtCore.QAbstractTableModel):
+    """
+    Table model over `data.transactions`. A row is only formatted once the
+    view wants to show it, and is remembered after that. Amounts come from
+    the ledger, which has already worked them out.
+    """
+    HEADERS = ["Amount", "Date", "Comment"]
+
+    def __init__(self, data, parent=None):
+        super().__init__(parent)
+        self.economy = data # not self.data, that's the method the view calls
+        self.rows = {} # row -> formatted (amount, date, comment)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.economy.transactions)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        row = self.rows.get(index.row())
+        if row is None:
+            transaction = self.economy.transactions[index.row()]
+            row = (format_money(self.economy.transactions.amount(index.row())),
+                   format_date(transaction.timestamp),
+                   transaction.compute_comment())
+            self.rows[index.row()] = row
+        return row[index.column()]
+
+    def add_transactions(self, transactions):
+        if not transactions:
+            return
+        first = len(self.economy.transactions)
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(transactions) - 1)
+        for transaction in transactions:
+            self.economy.add_transaction(transaction)
+        self.endInsertRows()
+
+    def remove_transaction(self, row):
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        self.economy.remove_transaction(row)
+        self.rows.clear() # everything after it has moved up a row
+        self.endRemoveRows()
+
 class TransactionsTab(QtWidgets.QWidget):
     recalculate = Qt.pyqtSignal()
     def __init__(self, data, parent=None):
@@ -226,9 +184,9 @@ class TransactionsTab(QtWidgets.QWidget):
         self.bottom_layout = QtWidgets.QHBoxLayout()
         
         self.table = KeybindTable(self)
-        self.table.setColumnCount(3)
-        self.table.setRowCount(0)
-        self.table.setHorizontalHeaderLabels(["Amount", "Date", "Comment"])
+        self.transaction_model = TransactionModel(data, self)
+        self.table.setModel(self.transaction_model)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
         header = self.table.horizontalHeader()
         header.setSectionResizeMode(2, QtWidgets.QHeaderView.Stretch)
         
@@ -249,15 +207,11 @@ class TransactionsTab(QtWidgets.QWidget):
         self.b_add.clicked.connect(self._add_transaction_button)
         self.table.keyPressed[QtGui.QKeyEvent].connect(self._table_keypress)
         
-        self.transaction_widgets = []
-        
-        for t in data.transactions:
-            self._add_transaction_to_table(t)
         self.recalculate.emit()
         
     def _table_keypress(self, event):
-        if event.key() == QtCore.Qt.Key_Delete and self.table.rowCount() > 0:
-            row = self.table.currentRow()
+        if event.key() == QtCore.Qt.Key_Delete and self.table.currentIndex().isValid():
+            row = self.table.currentIndex().row()
             t = self.data.transactions[row]
             if t.trans_type != TransactionType.MANUAL:
                 pass#return
@@ -265,9 +219,8 @@ class TransactionsTab(QtWidgets.QWidget):
             cont = QtWidgets.QMessageBox.question(self, "Really delete transaction?", "Really delete transaction?")
             if cont == QtWidgets.QMessageBox.No:
                 return
-            self.data.transactions.pop(row)
-            self.table.removeRow(row)
-            self.data.save()
+            self.transaction_model.remove_transaction(row)
+            self.data.mark_dirty()
             self.recalculate.emit()
 
     def _add_transaction_button(self):
@@ -285,50 +238,37 @@ class TransactionsTab(QtWidgets.QWidget):
         self.e_amount.setText("")
     
     def add_transaction(self, transaction: Transaction):
-        self.data.transactions.append(transaction)
-        self.data.save()
+        self.add_transactions([transaction])
 
-        self._add_transaction_to_table(transaction)
+    def add_transactions(self, transactions):
+        """Add all of `transactions`, then save and recalculate just the once"""
+        self.transaction_model.add_transactions(transactions)
+        self.data.mark_dirty()
         self.recalculate.emit()
-        
-    def _add_transaction_to_table(self, transaction: Transaction):
-        row = self.table.rowCount()
-        self.table.setRowCount(row + 1)
-        self.set_row_to(row, transaction)
-    
-    def set_row_to(self, row, transaction):
-        self.table.setItem(row, 0, QtWidgets.QTableWidgetItem(format_money(transaction.compute_amount())))
-        self.table.setItem(row, 1, QtWidgets.QTableWidgetItem(format_date(transaction.timestamp)))
-        self.table.setItem(row, 2, QtWidgets.QTableWidgetItem(transaction.compute_comment()))
 
-def calc_series(datas, series):
-    """Return a list of datapoints calculated from the backups"""
+def calc_series(metrics, series):
+    """Return a list of datapoints from the daily metrics"""
     if series == "Balance":
-        return [calc_bal(d) for d in datas]
+        return [m["balance"] for m in metrics]
     elif series == "Population":
-        return [calc_population(d)[0] for d in datas]
+        return [m["population"] for m in metrics]
     elif series == "Income":
-        return [calc_income(d)[0] for d in datas]
+        return [m["income"] for m in metrics]
     elif series == "Expenditure":
-        vals = []
-        for d in datas:
-            vals.append(0)
-            for trans in d.transactions:
-                if trans.timestamp == d.current_day.isoformat() and trans.compute_amount() < 0:
-                    vals[-1] -= trans.compute_amount()
-        return vals
+        return [m["expenditure"] for m in metrics]
     elif series == "Employment":
-        return [calc_employment(d) * 100 for d in datas]
+        return [m["employment"] * 100 for m in metrics]
     
     elif series == "Time":
-        return [i for i, d in enumerate(datas)]
+        return [i for i, m in enumerate(metrics)]
     
 class GraphControls(QtWidgets.QWidget):
     """Left-hand side bar used to control the graph"""
-    def __init__(self, figure, data, parent=None):
+    def __init__(self, figure, data, compute, parent=None):
         super().__init__(parent)
         self.figure = figure
         self.data = data
+        self.compute = compute
         self.ax = figure.subplots()
 
         self.layout = QtWidgets.QVBoxLayout(self)
@@ -428,13 +368,10 @@ class GraphControls(QtWidgets.QWidget):
             self.ax.axis('equal')
         
         elif gtype == "Line graph" or gtype == "Scatter graph":
-            datas = sorted(get_historical_datas(self.data), key=lambda d: d.current_day)
-            xvals = calc_series(datas, xaxis)
-            yvals = calc_series(datas, yaxis)
-            if gtype == "Line graph":
-                self.ax.plot(yvals, xvals)
-            else:
-                self.ax.scatter(yvals, xvals)
+            # the history can take a while to load, so plot it once the compute worker has it
+            self.compute.submit("history", get_historical_metrics, day_metrics(self.data),
+                                callback=lambda metrics: self._plot_history(gtype, xaxis, yaxis, metrics))
+            return
         
         # elif gtype == "Bar chart":
             # if xaxis == "Employment" and yaxis == "Region":
@@ -443,6 +380,15 @@ class GraphControls(QtWidgets.QWidget):
             
         self.figure.canvas.draw()
 
+    def _plot_history(self, gtype, xaxis, yaxis, metrics):
+        xvals = calc_series(metrics, xaxis)
+        yvals = calc_series(metrics, yaxis)
+        if gtype == "Line graph":
+            self.ax.plot(yvals, xvals)
+        else:
+            self.ax.scatter(yvals, xvals)
+        self.figure.canvas.draw()
+
 class MoronException(Exception):
     """For use if you make a file called `backups`"""
     pass
@@ -461,7 +407,7 @@ class StatsTab(QtWidgets.QWidget):
         self.graph_layout.addWidget(self.toolbar)
         self.graph_layout.addWidget(self.canvas)
 
-        self.graph_controls = GraphControls(self.figure, data, self)
+        self.graph_controls = GraphControls(self.figure, data, parent.compute, self)
 
         self.layout.addWidget(self.graph_controls, 0, 0, 1, 1)
         self.layout.addLayout(self.graph_layout, 0, 1, 3, 1)
@@ -608,59 +554,215 @@ class LoansTab(QtWidgets.QWidget):
             self.taken_loans_widget.add_loan_widgets(loan)
 
 class NetworkHandler:
-    """receive, decode and handle network packets"""
-    def __init__(self, data: Data, trans):
-        self.s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.data = data
-        self.trans = trans
-
-    def read(self):
-        data = b""
-        while not b"\n" in data:
-            d = self.s.recv(1024)
-            if not d:
-                break
-            data += d
-        print(data)
-        data = json.loads(data.decode("utf-8"))
-        return data
-
-    def send(self, data):
-        self.s.send(json.dumps(data).encode("utf-8") + b"\n")
-
-    def __enter__(self):
-        try:
-            self.s.connect(("127.0.0.1", 7896))
-        except Exception as e:
-            send_info_popup("Error connecting to server: " + str(e))
-            return None
-
-        self.send({"whoami": data.whoami})
-        packet_queue = self.read()
-        for packet in packet_queue:
-            date = datetime.date.fromisoformat(packet["date"])
-            if date <= data.current_day:
-                NetworkHandler.execute_packet(packet, self.data, self.trans, date)
-            else:
-                data.future_packets.append(packet)
-        return self
-
-    def execute_packet(packet, data: Data, trans, date: datetime.date):
+    """decode and handle network packets"""
+    def apply_packet(packet, data: Data):
+        """Apply `packet` to `data` without saving. Returns (transactions it adds, message for the user)"""
         if packet["type"] == "give_loan":
             loan = data.deserialise_loan(packet["loan"])
+            if any(l.uid == loan.uid for l in data.loans):
+                # sent again, because the sender closed before it knew the first one got through
+                return [], None
             data.loans.append(loan)
-            trans.add_transaction(Transaction(
+            transaction = Transaction(
                 TransactionType.TAKEN_LOAN,
-                date.isoformat(),
+                packet["date"],
                 comment=loan.country_name,
                 amount=loan.amount
-            ))
-            data.save()
-            send_info_popup(f"{loan.country_name} sent you a loan of {format_money(loan.amount)} at {loan.interest_rate:.2f}% interest")
+            )
+            return [transaction], f"{loan.country_name} sent you a loan of {format_money(loan.amount)} at {loan.interest_rate:.2f}% interest"
+        return [], None
+
+    def execute_packets(packets, data: Data, trans):
+        """Apply every one of `packets` (which should all be due by now), then save,
+        recalculate and tell the user about them all in one go"""
+        transactions = []
+        messages = []
+        for packet in packets:
+            new_transactions, message = NetworkHandler.apply_packet(packet, data)
+            transactions += new_transactions
+            if message is not None:
+                messages.append(message)
+
+        # adding the transactions does the saving
+        if transactions:
+            trans.add_transactions(transactions)
+        else:
+            data.mark_dirty()
+
+        if len(messages) > MAX_POPUP_LINES:
+            messages = messages[:MAX_POPUP_LINES - 1] + [f"...and {len(messages) - MAX_POPUP_LINES + 1} more"]
+        if messages:
+            send_info_popup("\n".join(messages))
+
+class NetworkWorker(QtCore.QThread):
+    """
+    QThread that keeps a connection to the server open for as long as the
+    program's running. Packets given to `send` go out in order as soon as
+    there's a connection, and packets for us come back through
+    `packets_received` as soon as the server passes them on. Once they've
+    been dealt with they need to be `ack`ed, or the server will send them
+    again next time.
+
+    A server too old to do frames sends packets without ids, doesn't push
+    anything after the queue it sends when we connect, and takes everything
+    as delivered as soon as it's sent, so with one of those nothing is acked
+    and packets are passed on as they are.
+    """
+    packets_received = Qt.pyqtSignal(list)
+    packet_sent = Qt.pyqtSignal(object) # a packet given to `send` is now with the server
+    failed = Qt.pyqtSignal(object) # sys.exc_info() of something that went wrong that wasn't the network
+    store_changed = Qt.pyqtSignal(str) # the server's packet store isn't the one `last_id` was from
+
+    def __init__(self, whoami, last_id=0, store=None):
+        super().__init__()
+        self.whoami = whoami
+        self.store = store # uid of the server's packet store that `last_id` is from
+        self.outgoing = queue.Queue()
+        self.unsent = [] # taken off `outgoing` but not sent yet, kept for if the connection drops
+        self.last_id = last_id # newest packet passed on, so anything sent twice is only handled once
+        self.saved_id = last_id # newest packet dealt with and saved before we started
+        self.connected = False
+        self.running = True
+        self.last_error = None
+        self.legacy = False # talking to a server too old to do frames
+
+    def send(self, packet):
+        self.outgoing.put(packet)
+
+    def ack(self, id):
+        self.outgoing.put({"ack": id})
+
+    def sync(self):
+        """Ask the server for anything waiting for us"""
+        self.outgoing.put({"sync": True})
+
+    def stop(self):
+        """Stop, after sending anything queued if there's a connection. Returns the packets
+        given to `send` that never got to the server, in order. `packet_sent` is only seen
+        once the event loop gets to it, which it won't if we're closing"""
+        self.running = False
+        self.wait()
+        while not self.outgoing.empty():
+            self.unsent.append(self.outgoing.get())
+        return [message for message in self.unsent if "player" in message]
+
+    def run(self):
+        while self.running:
+            try:
+                with socket.create_connection(SERVER_ADDRESS, timeout=RECONNECT_DELAY) as s:
+                    self.connected = True
+                    self.last_error = None
+                    self.serve(s)
+            except (OSError, ValueError) as e:
+                # only when it changes, not every RECONNECT_DELAY while the server's down
+                if str(e) != self.last_error:
+                    print("Network error: " + str(e))
+                    self.last_error = str(e)
+            except Exception:
+                # a bug, so the GUI thread deals with it like any other (excepthook isn't
+                # safe to call from here, it saves and shows a message box)
+                self.connected = False
+                self.failed.emit(sys.exc_info())
+                return
+            self.connected = False
+
+            retry = time.monotonic() + RECONNECT_DELAY
+            while self.running and time.monotonic() < retry:
+                time.sleep(0.1)
+
+    def serve(self, s):
+        """Talk to the server over `s` until it goes away or we're stopped"""
+        s.sendall(encode_line({"whoami": self.whoami, "acks": True, "framing": FRAMING}))
+        # the server always starts by sending our queue, which is a list, so if it's
+        # a line of json rather than a frame the server's too old to do frames
+        reader = None
+        encode = None
+        self.legacy = False
+        next_sync = time.monotonic() + SYNC_INTERVAL
+        while self.running:
+            while not self.outgoing.empty():
+                self.unsent.append(self.outgoing.get())
+            if time.monotonic() > next_sync:
+                self.unsent.append({"sync": True})
+                next_sync = time.monotonic() + SYNC_INTERVAL
+            if encode is not None:
+                self.send_unsent(s, encode)
+
+            readable, _, _ = select.select([s], [], [], 0.1)
+            if not readable:
+                continue
+            d = s.recv(65536)
+            if not d:
+                raise ConnectionError("server closed the connection")
+            if reader is None:
+                binary = not d.startswith(b"[")
+                reader = FrameReader() if binary else LineReader()
+                encode = encode_frame if binary else encode_line
+                self.legacy = not binary
+            for message in reader.feed(d):
+                if type(message) == list:
+                    self.received(message)
+                elif type(message) == dict and type(message.get("store")) == str:
+                    self.set_store(message["store"])
+                else:
+                    print("Unknown message from the server")
+
+        # anything asked for before stopping (acks especially) still goes
+        while not self.outgoing.empty():
+            self.unsent.append(self.outgoing.get())
+        if encode is not None:
+            self.send_unsent(s, encode)
+            s.sendall(encode("exit"))
+
+    def send_unsent(self, s, encode):
+        while self.unsent:
+            message = self.unsent[0]
+            # acks and syncs would only confuse an old server, it doesn't know about them
+            if not (self.legacy and not "player" in message):
+                s.sendall(encode(message))
+            self.unsent.pop(0)
+            if "player" in message:
+                self.packet_sent.emit(message)
+
+    def set_store(self, store):
+        """Packet ids start again from 1 in a new store, so if the server's on a different
+        one to last time, everything from it is new. With no store saved (from before
+        stores were told about) it's assumed to be the same one"""
+        if store == self.store:
+            return
+        if self.store is not None:
+            self.last_id = 0
+            self.saved_id = 0
+        self.store = store
+        self.store_changed.emit(store)
+
+    def valid(self, packet):
+        if type(packet) != dict or type(packet.get("date")) != str:
+            return False
+        try:
+            datetime.date.fromisoformat(packet["date"])
+        except ValueError:
+            return False
+        return self.legacy or type(packet.get("id")) == int
+
+    def received(self, packets):
+        good = [p for p in packets if self.valid(p)]
+        if len(good) < len(packets):
+            print(f"Ignoring {len(packets) - len(good)} malformed packet(s) from the server")
+        packets = good
+        if self.legacy:
+            if packets:
+                self.packets_received.emit(packets)
+            return
 
-    def __exit__(self, *args):
-        self.send("exit")
-        self.s.close()
+        # dealt with last time we ran, but the ack never got to the server
+        done = [p["id"] for p in packets if p["id"] <= self.saved_id]
+        if done:
+            self.outgoing.put({"ack": max(done)})
+        packets = [p for p in packets if p["id"] > self.last_id]
+        if packets:
+            self.last_id = packets[-1]["id"]
+            self.packets_received.emit(packets)
 
 class InfoBar(QtWidgets.QWidget):
     """Bottom bar of all tabs to show statistics"""
@@ -734,24 +836,23 @@ class InfoBar(QtWidgets.QWidget):
         self.l_regjobs.show()
 
     def update_info(self, data: Data, curr_region: str):
-        pop, reg_pop = calc_population(data)
-        jobs, reg_jobs = calc_jobs(data)
-        income, regional_income = calc_income(data)
+        totals = data.aggregates
+        income = totals.income()
         bal = calc_bal(data)
-        employment = calc_employment(data)
+        employment = totals.employment()
 
         data.eco_cache = income # TODO maybe bad idea?
         if curr_region != "Total":
             self._show_regional()
-            pop_of_current_region = reg_pop[curr_region]
-            jobs_of_current_region = reg_jobs[curr_region]
+            pop_of_current_region = totals.regional_population[curr_region]
+            jobs_of_current_region = totals.regional_jobs[curr_region]
         
             if pop_of_current_region  != 0:
                 employ_percent = jobs_of_current_region  / pop_of_current_region  * 100
             else:
                 employ_percent = 0
 
-            income_of_current_region  = regional_income[curr_region]
+            income_of_current_region  = totals.region_income(curr_region)
 
             self.l_regincome.setText("Income: " + str(format_money(income_of_current_region)))
             self.l_regemploy.setText("Employment: " + str(round(employ_percent, 1)) + "%")
@@ -763,8 +864,8 @@ class InfoBar(QtWidgets.QWidget):
         
         self.l_income.setText("Income: " + format_money(income))
         self.l_employment.setText("Employment: " + str(round(employment * 100, 2)) + "%")
-        self.l_pop.setText("Population: " + str(calc_population(data)[0]))
-        self.l_jobs.setText("Jobs: " + str(round(calc_jobs(data)[0], 2)))
+        self.l_pop.setText("Population: " + str(totals.population))
+        self.l_jobs.setText("Jobs: " + str(round(totals.jobs, 2)))
 
         self.l_lorentz.setText("L: " + str(round(Building.get_lorentz(data.eco_cache), 4)))
         self.l_date.setText("Current date: " + format_date(data.current_day.isoformat()))
@@ -775,8 +876,33 @@ class Main(QtWidgets.QWidget):
     def __init__(self, data):
         super().__init__()
         self.data = data
+        self.backups = BackupStore(BACKUP_STORE)
+        self.metrics = MetricsIndex(METRICS_FILE)
+
+        # saving, backups and loading history all happen on here
+        self.compute = ComputeWorker()
+        self.compute.job_failed.connect(lambda exc_info: sys.excepthook(*exc_info))
+        self.compute.start()
+        data.background = lambda write: self.compute.submit("save", write)
+
+        self.save_timer = QtCore.QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(int(SAVE_DELAY * 1000))
+        self.save_timer.timeout.connect(self._save)
+        data.schedule_save = self._schedule_save
+
         self.init_gui(data)
 
+        self.network = NetworkWorker(data.whoami, data.last_packet_id, data.packet_store)
+        self.network.store_changed.connect(self._store_changed)
+        self.network.packets_received.connect(self._packets_received)
+        self.network.packet_sent.connect(self._packet_sent)
+        self.network.failed.connect(lambda exc_info: sys.excepthook(*exc_info))
+        # whatever didn't get sent last time
+        for packet in data.outbox:
+            self.network.send(packet)
+        self.network.start()
+
         self.show()
         
     def init_gui(self, data):
@@ -810,21 +936,66 @@ class Main(QtWidgets.QWidget):
 
     def _refresh_network(self):
         # firstly check cached packets
-        packets_to_remove = []
-        for packet in self.data.future_packets:
-            date = datetime.date.fromisoformat(packet["date"])
-            if date <= data.current_day:
-                NetworkHandler.execute_packet(packet, self.data, self.transactions_tab, date)
-                packets_to_remove.append(packet)
-
-        # there is probably a better way of doing this
-        for packet in packets_to_remove:
-            self.data.future_packets.remove(packet)
-
-        with NetworkHandler(self.data, self.transactions_tab) as net:
-            pass
+        due = self.data.future_packets.pop_due(self.data.current_day)
+        if due:
+            NetworkHandler.execute_packets(due, self.data, self.transactions_tab)
+
+        if not self.network.connected:
+            send_info_popup("Can't reach the server at the moment, anything sent or received will go through once it's back")
+        self.network.sync()
         self.loans_tab.update_loan_widgets(self.data) # TODO inefficient
 
+    def _packets_received(self, packets):
+        due = []
+        for packet in packets:
+            if datetime.date.fromisoformat(packet["date"]) <= self.data.current_day:
+                due.append(packet)
+            else:
+                self.data.future_packets.add(packet)
+        if "id" in packets[-1]: # old servers don't give ids (or want acks)
+            self.data.last_packet_id = packets[-1]["id"]
+        NetworkHandler.execute_packets(due, self.data, self.transactions_tab)
+        # the server forgets them once they're acked (old ones as soon as they're sent),
+        # so they have to be on disk first
+        self.data.flush()
+        if "id" in packets[-1]:
+            self.network.ack(packets[-1]["id"])
+        self.loans_tab.update_loan_widgets(self.data)
+
+    def _store_changed(self, store):
+        # comes before any packets from the new store
+        if self.data.packet_store is not None:
+            self.data.last_packet_id = 0
+        self.data.packet_store = store
+        self.data.mark_dirty()
+
+    def _send(self, packet):
+        # kept in the data until it's gone, so it isn't lost if the server can't be reached before we close
+        self.data.outbox.append(packet)
+        self.data.mark_dirty()
+        self.network.send(packet)
+
+    def _packet_sent(self, packet):
+        self.data.outbox = [p for p in self.data.outbox if p is not packet]
+        self.data.mark_dirty()
+
+    def _schedule_save(self):
+        # not restarted if it's already going, so a steady stream of changes still gets saved
+        if not self.save_timer.isActive():
+            self.save_timer.start()
+
+    def _save(self):
+        if self.data.dirty:
+            self.data.save()
+
+    def closeEvent(self, event):
+        self.data.outbox = self.network.stop()
+        self.save_timer.stop()
+        self.compute.stop()
+        self.compute.wait()
+        self.data.flush()
+        super().closeEvent(event)
+
     def _loan_paid(self, loan, amount):
         if loan.amount < 0.01:
             self.data.loans.remove(loan)
@@ -851,7 +1022,7 @@ class Main(QtWidgets.QWidget):
             comment="UN",
             amount=amount,
         ))
-        self.data.save()
+        self.data.mark_dirty()
 
     def give_loan(self, loan: Loan):
         self.data.given_loans.append(loan)
@@ -862,28 +1033,24 @@ class Main(QtWidgets.QWidget):
             amount=loan.amount,
         ))
         self.send_loan_packet(loan, self.data.current_day.isoformat())
-        self.data.save()
+        self.data.mark_dirty()
 
     def send_loan_payment_packet(self, loan: Loan, amount: float, date: str):
-        with NetworkHandler(self.data, self.transactions_tab) as net:
-            if not net: return
-            net.send({"type": "loan_payment",
-                      "player": loan.country_name,
-                      "from": self.whoami,
-                      "loan_uid": loan.uid,
-                      "amount": amount,
-                      "date": date})
+        self._send({"type": "loan_payment",
+                    "player": loan.country_name,
+                    "from": self.data.whoami,
+                    "loan_uid": loan.uid,
+                    "amount": amount,
+                    "date": date})
         
 
     def send_loan_packet(self, loan: Loan, date: str):
-        with NetworkHandler(self.data, self.transactions_tab) as net:
-            if not net: return
-            loan_ser = self.data.serialise_loan(loan)
-            loan_ser[2] = self.data.whoami
-            net.send({"type": "give_loan",
-                      "player": loan.country_name,
-                      "loan": loan_ser,
-                      "date": date})
+        loan_ser = self.data.serialise_loan(loan)
+        loan_ser[2] = self.data.whoami
+        self._send({"type": "give_loan",
+                    "player": loan.country_name,
+                    "loan": loan_ser,
+                    "date": date})
 
         
     def get_paid(self):
@@ -893,7 +1060,7 @@ class Main(QtWidgets.QWidget):
             if n.comment == "Income" and n.timestamp == self.data.current_day.isoformat():
                 send_info_popup("YE CANNAE FOCKEN DAE THAT M8\n(you can only get paid once per day)")
                 return
-        income, regional_income = calc_income(data)
+        income = self.data.aggregates.income()
         self.transactions_tab.add_transaction(Transaction(
             TransactionType.MANUAL,
             self.data.current_day.isoformat(),
@@ -922,17 +1089,15 @@ class Main(QtWidgets.QWidget):
                 send_info_popup("Woah there buddy you aren't goint 88mph\n(you're trying to go into the future!)")
                 return
 
-        self.data.save()
-        if os.path.exists(BACKUP_DIR) and os.path.isfile(BACKUP_DIR):
+        # just try and make it rather than checking first, so nothing can change in between
+        try:
+            os.makedirs(BACKUP_DIR, exist_ok=True)
+        except FileExistsError:
             raise MoronException("You absolute idiot, you made a file called 'backups', that's where I want to store my backups! Please delete or rename it")
-        if not os.path.exists(BACKUP_DIR):
-            os.mkdir(BACKUP_DIR)
-        
-        # Yes, this is a race condition or TOC/TOU bug
-        # The truth is, I do not care, for it is exceedingly unlikely that anything could happen in between
-        # also it wouldn't even matter that much it would just crash and save the progress anyway lmao
-        
-        self.data.write_to_file(os.path.join(BACKUP_DIR, self.data.current_day.isoformat() + ".json"))
+
+        # take what goes in the backup now, the writing can happen in the background
+        self.compute.submit(None, self.backups.append_state, self.backups.state(self.data))
+        self.compute.submit(None, self.metrics.add_metrics, day_metrics(self.data))
             
         if delta is None:
             self.data.current_day = datetime.date.today()
@@ -942,10 +1107,10 @@ class Main(QtWidgets.QWidget):
         self.calc_loans()
         self._refresh_network()
         self.recalculate()
-        self.data.save()
+        self.data.mark_dirty()
 
 def exception_hook(exctype, value, tb):
-    data.save()
+    data.flush()
     exception_hook_no_save(exctype, value, tb)
 
 def exception_hook_no_save(exctype, value, tb):
@@ -1078,6 +1243,10 @@ if __name__ == '__main__':
         data.read_from_file(ECONOMY_FILE)
     else:
         data.set_defaults()
+    if data.whoami is None:
+        data.whoami, entered = QtWidgets.QInputDialog.getText(None, "Select country", "Enter which country you are (for network communication)")
+        if not entered:
+            sys.exit(0)
 
     # now the data has been loaded successfully, set normal excepthook that saves in case of error
     sys.excepthook = exception_hook
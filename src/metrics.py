@@ -0,0 +1,56 @@
+import json
+import os
+
+def day_metrics(data):
+    """The numbers the stats tab graphs for the day `data` is on"""
+    totals = data.aggregates
+    day = data.current_day.isoformat()
+    expenditure = 0
+    for i, trans in enumerate(data.transactions):
+        if trans.timestamp == day and data.transactions.amount(i) < 0:
+            expenditure -= data.transactions.amount(i)
+
+    return {"day": day,
+            "balance": data.transactions.balance(),
+            "income": totals.income(),
+            "expenditure": expenditure,
+            "employment": totals.employment(),
+            "population": totals.population,
+            "jobs": totals.jobs,
+            "regional_income": totals.regional_income(),
+            "regional_population": dict(totals.regional_population),
+            "regional_jobs": dict(totals.regional_jobs)}
+
+class MetricsIndex:
+    """
+    Small per-day summary of the economy (see `day_metrics`), appended to
+    whenever a backup is taken, so graphing history doesn't need every
+    backup to be loaded.
+    """
+    def __init__(self, fname):
+        self.fname = fname
+
+    def add(self, data):
+        self.add_metrics(day_metrics(data))
+
+    def add_metrics(self, metrics):
+        """Add a day's `day_metrics`, worked out earlier"""
+        with open(self.fname, "a") as f:
+            f.write(json.dumps(metrics) + "\n")
+
+    def rebuild(self, datas):
+        """Replace the whole index with the metrics of `datas`"""
+        with open(self.fname, "w") as f:
+            for data in datas:
+                f.write(json.dumps(day_metrics(data)) + "\n")
+
+    def days(self):
+        """{day: metrics} for every day in the index. Later entries for a day replace earlier ones"""
+        if not os.path.isfile(self.fname):
+            return {}
+        days = {}
+        with open(self.fname, "r") as f:
+            for line in f:
+                metrics = json.loads(line)
+                days[metrics["day"]] = metrics
+        return days
@@ -0,0 +1,34 @@
+import heapq
+
+class PacketSchedule:
+    """
+    Packets dated in the future, kept in a heap by date so the ones that have
+    come due can be taken off without looking at the rest. Packets for the
+    same day stay in the order they came in. Iterating goes in date order,
+    which is also how they're saved.
+    """
+    def __init__(self, packets=None):
+        self.heap = [] # (date, n, packet), iso dates sort the same as the dates do
+        self.n = 0
+        for packet in packets or []:
+            self.heap.append((packet["date"], self.n, packet))
+            self.n += 1
+        heapq.heapify(self.heap)
+
+    def add(self, packet):
+        heapq.heappush(self.heap, (packet["date"], self.n, packet))
+        self.n += 1
+
+    def pop_due(self, day):
+        """Take off and return every packet dated on or before `day` (a `datetime.date`), oldest first"""
+        day = day.isoformat()
+        due = []
+        while self.heap and self.heap[0][0] <= day:
+            due.append(heapq.heappop(self.heap)[2])
+        return due
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        return (packet for _, _, packet in sorted(self.heap))
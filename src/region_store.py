@@ -0,0 +1,122 @@
+from building import Building, date_bucket, intern_building
+
+class RegionStore:
+    """
+    Holds the buildings of one region as columns instead of one `Building`
+    object per block. Buildings with the same type, size, lorentz and date
+    (as far as it matters, see `date_bucket`) share a row and just bump its count, so the thousands of identical
+    farmland blocks in a region only take up a single row.
+    Iterating gives one `Building` per row, with `count` set accordingly.
+
+    The rows are also grouped by (btype, size), which is how they're shown
+    and sold, so the count of a group or the rows in it never need a scan.
+    """
+    def __init__(self, buildings=None):
+        self.btypes = []
+        self.sizes = []
+        self.lorentzes = []
+        self.counts = []
+        self.dates = []
+        self.index = {} # (btype, size, lorentz, date bucket) -> row
+        self.group_rows = {} # (btype, size) -> {row: None}, dict rather than set to keep them in order
+        self.group_counts = {} # (btype, size) -> number of buildings
+        if buildings is not None:
+            for building in buildings:
+                self.add(building)
+
+    def add(self, building: Building):
+        self.add_row(building.btype, building.size, building.lorentz, building.date, building.count)
+
+    def add_row(self, btype, size, lorentz, date, count=1):
+        key = (btype, size, lorentz, date_bucket(btype, date))
+        row = self.index.get(key)
+        if row is None:
+            self.index[key] = len(self.btypes)
+            self.btypes.append(btype)
+            self.sizes.append(size)
+            self.lorentzes.append(lorentz)
+            self.dates.append(date)
+            self.counts.append(count)
+            self.group_rows.setdefault((btype, size), {})[len(self.btypes) - 1] = None
+        else:
+            self.counts[row] += count
+        self.group_counts[(btype, size)] = self.group_counts.get((btype, size), 0) + count
+
+    def remove(self, building: Building):
+        """Remove exactly `building` (all `building.count` of it) from the region"""
+        row = self.index.get((building.btype, building.size, building.lorentz, date_bucket(building.btype, building.date)))
+        if row is None or self.counts[row] < building.count:
+            raise ValueError("RegionStore.remove called on a building that isn't in the region")
+        self.counts[row] -= building.count
+        self.group_counts[(building.btype, building.size)] -= building.count
+        if self.counts[row] == 0:
+            self._delete_row(row)
+
+    def take(self, btype, size, count, lorentz=None):
+        """Remove `count` buildings of the given type and size, most expensive (highest lorentz) first.
+        If `lorentz` is given, only buildings bought at that lorentz are taken.
+        Returns the removed buildings, one `Building` per row they were taken from"""
+        rows = list(self.group_rows.get((btype, size), ()))
+        if lorentz is not None:
+            rows = [r for r in rows if self.lorentzes[r] == lorentz]
+        rows.sort(key=lambda r: -self.lorentzes[r])
+        taken = []
+        for row in rows:
+            if count <= 0:
+                break
+            n = min(count, self.counts[row])
+            taken.append(intern_building(btype, self.dates[row], self.lorentzes[row], size, count=n))
+            count -= n
+
+        for building in taken:
+            self.remove(building)
+        return taken
+
+    def _delete_row(self, row):
+        # swap the last row into the hole so nothing else has to move
+        last = len(self.btypes) - 1
+        del self.index[self._key(row)]
+        group = (self.btypes[row], self.sizes[row])
+        del self.group_rows[group][row]
+        if not self.group_rows[group]:
+            del self.group_rows[group]
+            del self.group_counts[group]
+        if row != last:
+            for col in (self.btypes, self.sizes, self.lorentzes, self.counts, self.dates):
+                col[row] = col[last]
+            self.index[self._key(row)] = row
+            moved = self.group_rows[(self.btypes[row], self.sizes[row])]
+            del moved[last]
+            moved[row] = None
+        for col in (self.btypes, self.sizes, self.lorentzes, self.counts, self.dates):
+            col.pop()
+
+    def _key(self, row):
+        return (self.btypes[row], self.sizes[row], self.lorentzes[row], date_bucket(self.btypes[row], self.dates[row]))
+
+    def group_count(self, btype, size):
+        """How many buildings of this type and size there are"""
+        return self.group_counts.get((btype, size), 0)
+
+    def group(self, btype, size):
+        """(building, count) for the buildings of this type and size, where `building` is a
+        single one of them (count 1) to show them by. None if there aren't any"""
+        rows = self.group_rows.get((btype, size))
+        if not rows:
+            return None
+        row = next(iter(rows))
+        return Building(btype, self.dates[row], self.lorentzes[row], size), self.group_counts[(btype, size)]
+
+    def groups(self):
+        """{(btype, size): (building, count)} for every type and size in the region, see `group`"""
+        return {key: self.group(*key) for key in self.group_rows}
+
+    def num_buildings(self):
+        return sum(self.counts)
+
+    def __len__(self):
+        return len(self.btypes)
+
+    def __iter__(self):
+        for row in range(len(self.btypes)):
+            yield Building(self.btypes[row], self.dates[row], self.lorentzes[row], self.sizes[row], count=self.counts[row])
@@ -0,0 +1,67 @@
+import json
+import os
+
+# list items encoded per write. json.dump would do the whole thing in pure python,
+# so instead lists are cut up and each bit goes through the (fast) json.dumps.
+# The big things in economy.json are all lists (transactions, each region's buildings)
+CHUNK = 1000
+
+class Stale(Exception):
+    pass
+
+def write_snapshot(fname, raw_data, stale=None):
+    """
+    Write `raw_data` as json to `fname` so that `fname` is always either the
+    old file or the whole new one, never half of one: it's streamed into a
+    temporary file a chunk at a time (so the whole document never has to be
+    in memory as one string), synced to disk, then renamed over `fname`.
+
+    `stale` is checked between chunks; if it returns True a newer snapshot
+    is on its way, so this one is given up on. Returns whether it was written
+    """
+    tmp = fname + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            _stream(f, raw_data, stale)
+            f.flush()
+            os.fsync(f.fileno())
+    except Stale:
+        os.remove(tmp)
+        return False
+    os.replace(tmp, fname)
+    _sync_dir(os.path.dirname(fname) or ".")
+    return True
+
+def _stream(f, obj, stale):
+    if type(obj) == dict:
+        f.write("{")
+        for i, (key, value) in enumerate(obj.items()):
+            if i:
+                f.write(", ")
+            f.write(json.dumps(str(key)) + ": ")
+            _stream(f, value, stale)
+        f.write("}")
+    elif type(obj) == list:
+        f.write("[")
+        for i in range(0, len(obj), CHUNK):
+            if stale is not None and stale():
+                raise Stale()
+            if i:
+                f.write(", ")
+            f.write(json.dumps(obj[i:i + CHUNK])[1:-1])
+        f.write("]")
+    else:
+        f.write(json.dumps(obj))
+
+def _sync_dir(path):
+    """Make sure the rename itself is on disk. Not a thing on windows, where directories can't be opened"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -11,6 +11,9 @@ class TransactionType(IntEnum):
     TAKEN_LOAN = 6
 
 class Transaction:
+    # one of these per transaction per backup loaded, so keep them small (like `Building`)
+    __slots__ = ("amount", "comment", "trans_type", "buildings", "timestamp")
+
     def __init__(self, ty, timestamp, *, comment=None, amount=None, buildings=None):
         if ty in (TransactionType.MANUAL, TransactionType.GIVEN_LOAN, TransactionType.TAKEN_LOAN):
             assert comment != None, "Comment on manual transaction must not be None"
@@ -42,6 +45,6 @@ class Transaction:
         elif self.trans_type == TransactionType.GIVEN_LOAN:
             return f"Loan to {self.comment}"
         elif self.trans_type == TransactionType.BUY:
-            return f"Bought {len(self.buildings)}x {self.buildings[0].name()}"
+            return f"Bought {sum(b.count for b in self.buildings)}x {self.buildings[0].name()}"
         elif self.trans_type == TransactionType.SELL:
-            return f"Sold {len(self.buildings)}x {self.buildings[0].name()}"
\ No newline at end of file
+            return f"Sold {sum(b.count for b in self.buildings)}x {self.buildings[0].name()}"
\ No newline at end of file
@@ -0,0 +1,229 @@
+import datetime
+import json
+import struct
+
+# what a client puts as "framing" in its whoami to talk in frames rather than lines of json
+FRAMING = "binary"
+# biggest frame either end will take
+MAX_FRAME = 1 << 20
+
+# every frame is its length (not counting this header), what kind of frame it is, then the payload
+HEADER = struct.Struct(">IB")
+KIND_JSON = 0
+KIND_LIST = 1 # a list of messages, each one a whole frame of its own
+KIND_SHAPED = 2 # packets in SHAPES are this plus their index in SHAPES
+
+NUM, INT, STR, DATE = range(4) # NUM is an int or a float, INT has to be an int
+# packets that always look the same, so they can be packed into a struct rather than written
+# out as json. Each field is (key, or key and index for lists, what sort of value it is)
+SHAPES = [
+    ("give_loan", [(("player",), STR),
+                   (("loan", 0), NUM), # amount
+                   (("loan", 1), NUM), # interest rate
+                   (("loan", 2), STR), # country name
+                   (("loan", 3), NUM), # amount paid
+                   (("loan", 4), INT), # uid
+                   (("date",), DATE)]),
+    ("loan_payment", [(("player",), STR),
+                      (("from",), STR),
+                      (("loan_uid",), INT),
+                      (("amount",), NUM),
+                      (("date",), DATE)]),
+]
+SHAPE_INDEX = {name: i for i, (name, _) in enumerate(SHAPES)}
+INT_RANGE = range(-2**63, 2**63)
+
+class Shape:
+    """How to pack and unpack the packets of one of `SHAPES`"""
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.keys = {path[0] for path, _ in fields} | {"type"}
+        self.lists = {} # {key: length} of the keys that are lists
+        for path, _ in fields:
+            if len(path) == 2:
+                self.lists[path[0]] = max(self.lists.get(path[0], 0), path[1] + 1)
+        self.structs = {}
+
+    def struct(self, flags):
+        """The struct for the fixed size part: flags, id, then every field but the strings,
+        which go after as (length, utf-8). NUMs are packed as whatever they were, so ints
+        come back as ints, and `flags` says which"""
+        if not flags in self.structs:
+            fmt = ">Bq"
+            for i, (_, t) in enumerate(self.fields):
+                if t == NUM:
+                    fmt += "q" if flags & (2 << i) else "d"
+                elif t == INT:
+                    fmt += "q"
+                elif t == DATE:
+                    fmt += "I"
+            self.structs[flags] = struct.Struct(fmt)
+        return self.structs[flags]
+
+    def pack(self, packet):
+        """`packet` packed, or None if it's not quite this shape, so packing it would lose something"""
+        if not set(packet).difference(("id",)) == self.keys:
+            return None
+        flags = 0
+        if "id" in packet:
+            if not (type(packet["id"]) == int and packet["id"] in INT_RANGE):
+                return None
+            flags = 1
+        for key, length in self.lists.items():
+            if type(packet[key]) != list or len(packet[key]) != length:
+                return None
+
+        fixed = []
+        strings = []
+        for i, (path, t) in enumerate(self.fields):
+            value = packet[path[0]] if len(path) == 1 else packet[path[0]][path[1]]
+            if t == NUM or t == INT:
+                if type(value) == int and value in INT_RANGE:
+                    flags |= 2 << i
+                elif not (t == NUM and type(value) == float):
+                    return None
+                fixed.append(value)
+            elif t == DATE:
+                try:
+                    date = datetime.date.fromisoformat(value)
+                except (TypeError, ValueError):
+                    return None
+                if date.isoformat() != value:
+                    return None
+                fixed.append(date.toordinal())
+            else:
+                if type(value) != str:
+                    return None
+                value = value.encode("utf-8")
+                if len(value) >= 2**16:
+                    return None
+                strings.append(struct.pack(">H", len(value)))
+                strings.append(value)
+        return self.struct(flags).pack(flags, packet.get("id", 0), *fixed) + b"".join(strings)
+
+    def unpack(self, payload):
+        flags = payload[0]
+        fixed_struct = self.struct(flags)
+        _, id, *fixed = fixed_struct.unpack_from(payload)
+        offset = fixed_struct.size
+        packet = {"type": self.name}
+        for key, length in self.lists.items():
+            packet[key] = [None] * length
+        if flags & 1:
+            packet["id"] = id
+
+        fixed = iter(fixed)
+        for path, t in self.fields:
+            if t == DATE:
+                value = datetime.date.fromordinal(next(fixed)).isoformat()
+            elif t == STR:
+                length = (payload[offset] << 8) | payload[offset + 1]
+                value = payload[offset + 2:offset + 2 + length].decode("utf-8")
+                offset += 2 + length
+            else:
+                value = next(fixed)
+
+            if len(path) == 1:
+                packet[path[0]] = value
+            else:
+                packet[path[0]][path[1]] = value
+        return packet
+
+SHAPE_OBJECTS = [Shape(name, fields) for name, fields in SHAPES]
+
+def encode_frame(message):
+    """`message` (anything json can write) as one frame"""
+    if type(message) == list:
+        return _list_frame([encode_frame(m) for m in message])
+    else:
+        payload = None
+        if type(message) == dict and message.get("type") in SHAPE_INDEX:
+            kind = KIND_SHAPED + SHAPE_INDEX[message["type"]]
+            payload = SHAPE_OBJECTS[kind - KIND_SHAPED].pack(message)
+        if payload is None:
+            kind = KIND_JSON
+            payload = json.dumps(message).encode("utf-8")
+    return HEADER.pack(len(payload), kind) + payload
+
+def encode_frames(message):
+    """
+    Same as `encode_frame`, but a list too big for one frame is split up and
+    sent as several lists, each under MAX_FRAME, as the other end won't take
+    anything bigger. A single message too big for a frame on its own is
+    still sent, in a list of its own
+    """
+    if type(message) != list:
+        return encode_frame(message)
+    frames = []
+    batch = []
+    size = 4 # the count at the start of a list
+    for m in message:
+        frame = encode_frame(m)
+        if batch and size + len(frame) > MAX_FRAME:
+            frames.append(_list_frame(batch))
+            batch = []
+            size = 4
+        batch.append(frame)
+        size += len(frame)
+    frames.append(_list_frame(batch))
+    return b"".join(frames)
+
+def _list_frame(frames):
+    """A KIND_LIST frame of the already encoded `frames`"""
+    payload = struct.pack(">I", len(frames)) + b"".join(frames)
+    return HEADER.pack(len(payload), KIND_LIST) + payload
+
+def decode_frame(kind, payload):
+    """The message in a frame's payload. Raises ValueError if it's not a valid frame"""
+    try:
+        if kind == KIND_JSON:
+            return json.loads(payload.decode("utf-8"))
+        if kind == KIND_LIST:
+            count, = struct.unpack_from(">I", payload)
+            messages = []
+            offset = 4
+            for _ in range(count):
+                length, kind = HEADER.unpack_from(payload, offset)
+                offset += HEADER.size
+                messages.append(decode_frame(kind, payload[offset:offset + length]))
+                offset += length
+            return messages
+        if KIND_SHAPED <= kind < KIND_SHAPED + len(SHAPES):
+            return SHAPE_OBJECTS[kind - KIND_SHAPED].unpack(payload)
+    except (struct.error, UnicodeDecodeError, OverflowError, IndexError, StopIteration) as e:
+        raise ValueError("Bad frame: " + str(e))
+    raise ValueError(f"Unknown frame kind {kind}")
+
+def encode_line(message):
+    """`message` as a line of json, for the other end if it doesn't do frames"""
+    return json.dumps(message).encode("utf-8") + b"\n"
+
+class FrameReader:
+    """Turns bytes as they come in into messages, a frame at a time"""
+    def __init__(self):
+        self.data = bytearray()
+
+    def feed(self, data):
+        """Add `data` to what's been received, and yield every message that's now complete"""
+        self.data += data
+        while len(self.data) >= HEADER.size:
+            length, kind = HEADER.unpack_from(self.data)
+            if length > MAX_FRAME:
+                raise ValueError("Frame too long")
+            if len(self.data) < HEADER.size + length:
+                break
+            payload = bytes(self.data[HEADER.size:HEADER.size + length])
+            del self.data[:HEADER.size + length]
+            yield decode_frame(kind, payload)
+
+class LineReader:
+    """Same as `FrameReader`, for newline terminated json"""
+    def __init__(self):
+        self.data = b""
+
+    def feed(self, data):
+        self.data += data
+        while b"\n" in self.data:
+            line, self.data = self.data.split(b"\n", 1)
+            yield json.loads(line.decode("utf-8"))